@@ -0,0 +1,107 @@
+"""Compares the two CHUNK_EMBEDDING_MODE settings of process_note.
+
+"chunk" runs the model again over every chunk, "sentence" pools the sentence
+vectors the chunker already computed. Reports per-note latency for each mode
+and how closely the pooled vectors track the model's chunk vectors, both
+directly (cosine) and as search results (top-k overlap for sample queries).
+
+    uv run python -m benchmarks.chunk_embedding_benchmark --notes 200
+    uv run python -m benchmarks.chunk_embedding_benchmark --notes-dir ./my-notes
+"""
+import argparse
+import json
+import random
+import time
+import numpy as np
+from typing import List, Dict, Any
+from commons.cache import embedding_cache
+from benchmarks.corpus import generate_notes, generate_sentence, load_notes, TOPICS
+from commons.qdrant.qdrant_helper import embed_texts
+from features.embedding.embedding_service import embed_note_chunks
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def run_mode(notes: List[str], mode: str) -> Dict[str, Any]:
+    latencies = []
+    chunks = []
+    vectors = []
+
+    for note in notes:
+        start = time.perf_counter()
+        note_chunks, note_vectors = embed_note_chunks(note, mode=mode)
+        latencies.append(time.perf_counter() - start)
+        chunks.extend(note_chunks)
+        vectors.extend(note_vectors)
+
+    total = sum(latencies)
+    return {
+        "chunks": chunks,
+        "vectors": np.array(vectors, dtype=np.float32),
+        "stats": {
+            "mode": mode,
+            "notes": len(notes),
+            "chunks": len(chunks),
+            "total_seconds": total,
+            "notes_per_second": len(notes) / total if total else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+        },
+    }
+
+
+def top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ vectors.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=100, help="number of synthetic notes to generate")
+    parser.add_argument("--notes-dir", help="directory of .md notes to use instead of synthetic ones")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    # cached vectors would hide the model cost being measured
+    embedding_cache.EMBEDDING_CACHE_ENABLED = False
+
+    notes = load_notes(args.notes_dir) if args.notes_dir else generate_notes(args.notes)
+
+    embed_texts(["warmup"])
+    baseline = run_mode(notes, "chunk")
+    pooled = run_mode(notes, "sentence")
+
+    if baseline["chunks"] != pooled["chunks"]:
+        raise RuntimeError("Modes produced different chunks, vectors are not comparable")
+
+    chunk_vectors = baseline["vectors"]
+    pooled_vectors = pooled["vectors"]
+    chunk_vectors /= np.linalg.norm(chunk_vectors, axis=1, keepdims=True)
+    cosines = np.einsum("ij,ij->i", chunk_vectors, pooled_vectors)
+
+    rng = random.Random(7)
+    queries = [generate_sentence(rng, rng.choice(list(TOPICS))) for _ in range(args.queries)]
+    query_vectors = np.array(embed_texts(queries), dtype=np.float32)
+    k = min(args.k, len(chunk_vectors))
+    expected = top_k(chunk_vectors, query_vectors, k)
+    actual = top_k(pooled_vectors, query_vectors, k)
+    overlap = [len(set(e) & set(a)) / k for e, a in zip(expected, actual)]
+
+    report = {
+        "chunk": baseline["stats"],
+        "sentence": pooled["stats"],
+        "speedup": baseline["stats"]["total_seconds"] / pooled["stats"]["total_seconds"] if pooled["stats"]["total_seconds"] else 0.0,
+        "quality": {
+            "mean_cosine_to_chunk_vector": float(cosines.mean()) if len(cosines) else 0.0,
+            "min_cosine_to_chunk_vector": float(cosines.min()) if len(cosines) else 0.0,
+            f"top{k}_overlap": float(np.mean(overlap)) if overlap else 0.0,
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import os
+import random
+from typing import List, Tuple
+from PIL import Image, ImageDraw
+
+
+TOPICS = {
+    "cooking": ["recipe", "garlic", "oven", "simmer", "sourdough", "spices", "roast", "broth", "knife", "dough"],
+    "travel": ["flight", "itinerary", "hostel", "passport", "train", "museum", "beach", "visa", "luggage", "map"],
+    "software": ["deploy", "database", "latency", "refactor", "cache", "index", "queue", "container", "release", "bug"],
+    "fitness": ["run", "squat", "protein", "stretch", "marathon", "interval", "recovery", "sleep", "heart", "weights"],
+    "finance": ["budget", "invoice", "savings", "mortgage", "dividend", "expense", "tax", "portfolio", "rent", "loan"],
+    "garden": ["tomato", "compost", "seedling", "prune", "soil", "watering", "mulch", "bloom", "harvest", "weeds"],
+}
+
+TEMPLATES = [
+    "We talked about the {0} and decided the {1} can wait until next week.",
+    "The {0} took longer than expected because the {1} was not ready.",
+    "Remember to check the {0} before touching the {1} again.",
+    "I noticed that the {0} works much better when the {1} is prepared first.",
+    "Next time the {0} should be planned together with the {1}.",
+    "Nobody expected the {0} to matter this much for the {1}.",
+    "The notes from today say the {0} and the {1} are both on track.",
+]
+
+
+def generate_sentence(rng: random.Random, topic: str) -> str:
+    words = rng.sample(TOPICS[topic], 2)
+    return rng.choice(TEMPLATES).format(*words)
+
+
+def generate_note(rng: random.Random, sections: int = 3, sentences_per_section: int = 8) -> str:
+    lines = [f"# {rng.choice(list(TOPICS)).capitalize()} notes", ""]
+
+    for _ in range(sections):
+        topic = rng.choice(list(TOPICS))
+        lines.append(f"## {topic.capitalize()}")
+        lines.append("")
+        lines.append(" ".join(generate_sentence(rng, topic) for _ in range(sentences_per_section)))
+        lines.append("")
+
+        if rng.random() < 0.3:
+            lines.append(f"- {generate_sentence(rng, topic)}")
+            lines.append(f"- See [the {topic} page](https://example.com/{topic}) for details.")
+            lines.append("")
+
+        if rng.random() < 0.2:
+            lines.append("```")
+            lines.append(f"echo {topic}")
+            lines.append("```")
+            lines.append("")
+
+    return "\n".join(lines)
+
+
+def generate_notes(count: int, seed: int = 42, sections: int = 3, sentences_per_section: int = 8) -> List[str]:
+    rng = random.Random(seed)
+    return [generate_note(rng, sections, sentences_per_section) for _ in range(count)]
+
+
+def load_notes(notes_dir: str) -> List[str]:
+    notes = []
+    for name in sorted(os.listdir(notes_dir)):
+        if name.endswith(".md"):
+            with open(os.path.join(notes_dir, name), encoding="utf-8") as f:
+                notes.append(f.read())
+    return notes
+
+
+IMAGE_SIZES = [(640, 480), (1024, 768), (1920, 1080), (800, 800), (1080, 1920)]
+IMAGE_FORMATS = ["JPEG", "PNG"]
+
+
+def generate_image(rng: random.Random, size: Tuple[int, int], shapes: int = 12) -> Image.Image:
+    image = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(shapes):
+        x0, y0 = rng.randrange(size[0]), rng.randrange(size[1])
+        box = [x0, y0, x0 + rng.randrange(20, size[0] // 2), y0 + rng.randrange(20, size[1] // 2)]
+        fill = tuple(rng.randrange(256) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.ellipse(box, fill=fill)
+        else:
+            draw.rectangle(box, fill=fill)
+    return image
+
+
+def generate_images(directory: str, count: int, seed: int = 42, start: int = 0) -> List[str]:
+    # writes count images of mixed sizes and formats, names continue from start so later calls add new files
+    rng = random.Random(seed + start)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(start, start + count):
+        image_format = rng.choice(IMAGE_FORMATS)
+        path = os.path.join(directory, f"image-{i:06d}.{'jpg' if image_format == 'JPEG' else 'png'}")
+        generate_image(rng, rng.choice(IMAGE_SIZES)).save(path, format=image_format)
+        paths.append(path)
+    return paths
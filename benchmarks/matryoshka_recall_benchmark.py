@@ -0,0 +1,102 @@
+"""Compares single stage note search with the two stage Matryoshka layout.
+
+The single stage collection indexes the full 768-d vectors. The two stage
+collections index only a short prefix of each vector and rescore
+QDRANT_PREFETCH_MULTIPLIER candidates per result with the full vector. Chunks
+of the corpus are embedded with the note model and written to one scratch
+collection per layout in the configured Qdrant. Each layout reports recall@k
+against exact (brute force) search, query latency and the size of the
+vectors its HNSW index is built over.
+
+    uv run python -m benchmarks.matryoshka_recall_benchmark --notes 500 --short-dims 128 256 512
+    uv run python -m benchmarks.matryoshka_recall_benchmark --notes-dir ./my-notes
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+import numpy as np
+from typing import List, Dict, Any
+from benchmarks.corpus import generate_notes, generate_sentence, load_notes, TOPICS
+from commons.qdrant.qdrant_client import PREFETCH_MULTIPLIER, client, create_collection_if_not_exists, search_similar, upsert_points
+from commons.qdrant.qdrant_helper import TEXT_EMBED_DIM, embed_texts
+from features.chunking.chunking_service import chunk_notes
+
+COLLECTION_PREFIX = "matryoshka_benchmark"
+UPSERT_BATCH_SIZE = 500
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def populate(collection_name: str, short_vector_dim: int, chunk_ids: List[str], vectors: List[List[float]]) -> None:
+    create_collection_if_not_exists(collection_name, TEXT_EMBED_DIM, short_vector_dim=short_vector_dim)
+    for start in range(0, len(vectors), UPSERT_BATCH_SIZE):
+        upsert_points(collection_name, [
+            {"id": chunk_id, "vector": vector, "payload": {}}
+            for chunk_id, vector in zip(chunk_ids[start:start + UPSERT_BATCH_SIZE], vectors[start:start + UPSERT_BATCH_SIZE])
+        ])
+
+
+def run(collection_name: str, short_vector_dim: int, query_vectors: List[List[float]], expected: List[List[str]], k: int) -> Dict[str, Any]:
+    latencies = []
+    recalls = []
+
+    for query_vector, expected_ids in zip(query_vectors, expected):
+        start = time.perf_counter()
+        results = search_similar(collection_name, query_vector, limit=k, threshold=-1.0)
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len({result["id"] for result in results} & set(expected_ids)) / len(expected_ids))
+
+    return {
+        "layout": f"two stage ({short_vector_dim}-d prefix)" if short_vector_dim else "single stage",
+        "indexed_dim": short_vector_dim or TEXT_EMBED_DIM,
+        f"recall@{k}": float(np.mean(recalls)),
+        "min_recall": float(np.min(recalls)),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=500, help="number of synthetic notes to generate")
+    parser.add_argument("--notes-dir", help="directory of .md notes to use instead of synthetic ones")
+    parser.add_argument("--short-dims", type=int, nargs="+", default=[128, 256, 512], help="prefix sizes to compare")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    notes = load_notes(args.notes_dir) if args.notes_dir else generate_notes(args.notes)
+    chunks = [chunk for note_chunks in chunk_notes(notes) for chunk in note_chunks]
+    vectors = embed_texts(chunks)
+    chunk_ids = [str(uuid.uuid4()) for _ in chunks]
+
+    rng = random.Random(7)
+    queries = [generate_sentence(rng, rng.choice(list(TOPICS))) for _ in range(args.queries)]
+    query_vectors = embed_texts(queries)
+    k = min(args.k, len(chunks))
+
+    # model vectors are normalized, so the dot product is the cosine score Qdrant ranks by
+    scores = np.array(query_vectors, dtype=np.float32) @ np.array(vectors, dtype=np.float32).T
+    expected = [[chunk_ids[i] for i in row] for row in np.argsort(-scores, axis=1)[:, :k]]
+
+    report = {"chunks": len(chunks), "queries": len(queries), "prefetch_multiplier": PREFETCH_MULTIPLIER, "layouts": []}
+    for short_vector_dim in [0, *args.short_dims]:
+        collection_name = f"{COLLECTION_PREFIX}_{short_vector_dim}"
+        if client.collection_exists(collection_name):
+            client.delete_collection(collection_name)
+
+        try:
+            populate(collection_name, short_vector_dim, chunk_ids, vectors)
+            report["layouts"].append(run(collection_name, short_vector_dim, query_vectors, expected, k))
+        finally:
+            client.delete_collection(collection_name)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Compares the SENTENCE_SEGMENTER backends against the parser-based splits.
+
+For every backend reports pipeline load time, per-note latency (nlp(content)),
+bulk throughput (nlp.pipe) and how its sentences and resulting chunks differ
+from the "parser" backend on the same notes.
+
+    uv run python -m benchmarks.segmentation_benchmark --notes 200
+    uv run python -m benchmarks.segmentation_benchmark --notes-dir ./my-notes --processes 4
+"""
+import argparse
+import json
+import time
+import numpy as np
+from typing import List, Dict, Any
+from benchmarks.corpus import generate_notes, load_notes
+from commons.qdrant.qdrant_helper import embed_texts
+from features.chunking.chunking_service import clean_note_content, compute_adjacent_similarities, group_sentences, join_sentence_groups
+from features.chunking.segmentation_service import SENTENCE_SEGMENTERS, load_pipeline, sentences_from_doc
+
+
+def chunk_sentences(sentences: List[str], content: str) -> List[str]:
+    if len(sentences) <= 1:
+        return [content]
+
+    embeddings = np.array(embed_texts(sentences), dtype=np.float64)
+    return join_sentence_groups(sentences, group_sentences(sentences, compute_adjacent_similarities(embeddings)))
+
+
+def run_segmenter(segmenter: str, contents: List[str], processes: int) -> Dict[str, Any]:
+    start = time.perf_counter()
+    pipeline = load_pipeline(segmenter)
+    load_seconds = time.perf_counter() - start
+
+    latencies = []
+    sentence_lists = []
+    for content in contents:
+        start = time.perf_counter()
+        sentence_lists.append(sentences_from_doc(pipeline(content)))
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    list(pipeline.pipe(contents, n_process=processes, batch_size=64))
+    bulk_seconds = time.perf_counter() - start
+
+    return {
+        "sentences": sentence_lists,
+        "stats": {
+            "segmenter": segmenter,
+            "pipeline": pipeline.pipe_names,
+            "load_seconds": load_seconds,
+            "p50_ms": float(np.percentile(latencies, 50)) * 1000,
+            "p95_ms": float(np.percentile(latencies, 95)) * 1000,
+            "bulk_notes_per_second": len(contents) / bulk_seconds if bulk_seconds else 0.0,
+            "sentences": sum(len(s) for s in sentence_lists),
+        },
+    }
+
+
+def compare(baseline: List[List[str]], candidate: List[List[str]]) -> Dict[str, float]:
+    identical = sum(1 for b, c in zip(baseline, candidate) if b == c)
+    jaccard = []
+    for b, c in zip(baseline, candidate):
+        union = set(b) | set(c)
+        jaccard.append(len(set(b) & set(c)) / len(union) if union else 1.0)
+
+    return {
+        "identical_notes": identical / len(baseline) if baseline else 1.0,
+        "mean_jaccard": float(np.mean(jaccard)) if jaccard else 1.0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=100, help="number of synthetic notes to generate")
+    parser.add_argument("--notes-dir", help="directory of .md notes to use instead of synthetic ones")
+    parser.add_argument("--processes", type=int, default=1, help="n_process for the nlp.pipe measurement")
+    args = parser.parse_args()
+
+    notes = load_notes(args.notes_dir) if args.notes_dir else generate_notes(args.notes)
+    contents = [content for content in (clean_note_content(note) for note in notes) if content]
+
+    runs = {segmenter: run_segmenter(segmenter, contents, args.processes) for segmenter in SENTENCE_SEGMENTERS}
+    chunks = {
+        segmenter: [chunk_sentences(sentences, content) for sentences, content in zip(run["sentences"], contents)]
+        for segmenter, run in runs.items()
+    }
+
+    report = []
+    for segmenter, run in runs.items():
+        report.append({
+            **run["stats"],
+            "sentences_vs_parser": compare(runs["parser"]["sentences"], run["sentences"]),
+            "chunks_vs_parser": compare(chunks["parser"], chunks[segmenter]),
+        })
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Compares per-chunk similarity searches with one batched search.
+
+find_similar_notes used to send one search per source chunk and drop the
+source note's own chunks client side. It now sends every chunk vector in a
+single search_batch request with the source note excluded by a must_not
+filter. This runs both against a scratch collection of synthetic clustered
+vectors (no models involved) in the configured Qdrant and reports latency per
+source note size, plus how often both return the same top notes.
+
+    uv run python -m benchmarks.similarity_search_benchmark --notes 2000 --chunks 10 50 100
+"""
+import argparse
+import json
+import time
+import uuid
+import numpy as np
+from collections import Counter
+from typing import List, Dict, Any
+from commons.qdrant.qdrant_client import client, create_collection_if_not_exists, upsert_points, search_similar, search_similar_batch
+
+COLLECTION = "similarity_benchmark"
+DIM = 768
+TOPICS = 50
+UPSERT_BATCH_SIZE = 500
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def populate(rng: np.random.Generator, notes: int, chunks_per_note: int) -> np.ndarray:
+    topics = normalize(rng.normal(size=(TOPICS, DIM)))
+    note_topics = rng.integers(0, TOPICS, size=notes)
+    points = []
+
+    for note_id, topic in enumerate(note_topics):
+        vectors = normalize(topics[topic] + 0.08 * rng.normal(size=(chunks_per_note, DIM)))
+        for chunk_index, vector in enumerate(vectors):
+            points.append({"id": str(uuid.uuid4()), "vector": vector.tolist(), "payload": {"note_id": note_id, "chunk_index": chunk_index}})
+
+        if len(points) >= UPSERT_BATCH_SIZE:
+            upsert_points(COLLECTION, points)
+            points = []
+
+    upsert_points(COLLECTION, points)
+    return topics
+
+
+def top_notes(results: List[List[Dict[str, Any]]], source_note_id: int, k: int) -> List[int]:
+    counts = Counter(r["payload"]["note_id"] for chunk_results in results for r in chunk_results if r["payload"]["note_id"] != source_note_id)
+    return [note_id for note_id, _ in counts.most_common(k)]
+
+
+def run(rng: np.random.Generator, topics: np.ndarray, chunk_counts: List[int], samples: int, limit: int, threshold: float) -> List[Dict[str, Any]]:
+    report = []
+    for chunk_count in chunk_counts:
+        loop_latencies = []
+        batch_latencies = []
+        overlap = []
+
+        for _ in range(samples):
+            # note 0 stands in for the source note, the loop drops it client side and the batch excludes it in Qdrant
+            vectors = normalize(topics[rng.integers(0, TOPICS)] + 0.08 * rng.normal(size=(chunk_count, DIM))).tolist()
+
+            start = time.perf_counter()
+            loop_results = [search_similar(COLLECTION, vector, limit=limit * 3, threshold=threshold) for vector in vectors]
+            loop_latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            batch_results = search_similar_batch(COLLECTION, vectors, limit=limit * 3, threshold=threshold, exclude={"note_id": 0})
+            batch_latencies.append(time.perf_counter() - start)
+
+            expected = top_notes(loop_results, 0, limit)
+            actual = top_notes(batch_results, 0, limit)
+            overlap.append(len(set(expected) & set(actual)) / len(expected) if expected else 1.0)
+
+        report.append({
+            "chunks": chunk_count,
+            "loop_p50_ms": percentile(loop_latencies, 50) * 1000,
+            "loop_p95_ms": percentile(loop_latencies, 95) * 1000,
+            "batch_p50_ms": percentile(batch_latencies, 50) * 1000,
+            "batch_p95_ms": percentile(batch_latencies, 95) * 1000,
+            "speedup_p50": percentile(loop_latencies, 50) / percentile(batch_latencies, 50),
+            "top_notes_overlap": float(np.mean(overlap)),
+        })
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=2000, help="notes in the scratch collection")
+    parser.add_argument("--chunks-per-note", type=int, default=5)
+    parser.add_argument("--chunks", type=int, nargs="+", default=[10, 50, 100], help="source note sizes to measure")
+    parser.add_argument("--samples", type=int, default=10, help="source notes per size")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--threshold", type=float, default=0.5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    if client.collection_exists(COLLECTION):
+        client.delete_collection(COLLECTION)
+    create_collection_if_not_exists(COLLECTION, DIM)
+
+    try:
+        topics = populate(rng, args.notes, args.chunks_per_note)
+        report = run(rng, topics, args.chunks, args.samples, args.limit, args.threshold)
+    finally:
+        client.delete_collection(COLLECTION)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
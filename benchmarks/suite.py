@@ -0,0 +1,233 @@
+"""Offline benchmark suite for ingestion, search and similarity.
+
+Runs against Qdrant's local mode (QDRANT_LOCAL_PATH, in memory unless set to
+a directory, whose collections are deleted first) with the models loaded from
+the fastembed cache, so no server or network is involved. For every scale the
+notes collection is filled with synthetic Markdown notes until it holds that
+many chunks, and the images collection with generated images (--image-ratio
+per chunk). Then each operation is timed over --samples calls:
+
+    chunk_note, process_note, process_image, search_notes,
+    find_similar_notes, find_similar_images
+
+The embedding, query, result and outlier caches are off so every call pays
+for its work. The report is JSON with p50/p95/p99 latency and throughput per
+operation and scale, plus the commit it ran on, so runs can be diffed.
+Local mode searches by exact scan, absolute numbers are not those of a
+Qdrant server; compare runs on the same machine.
+
+    uv run python -m benchmarks.suite --scales 1000 10000 100000 --output bench.json
+    QDRANT_LOCAL_PATH=/tmp/bench-qdrant uv run python -m benchmarks.suite --scales 1000 --samples 20
+"""
+import os
+
+os.environ.setdefault("QDRANT_LOCAL_PATH", ":memory:")
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("EMBEDDING_CACHE_ENABLED", "false")
+os.environ.setdefault("QUERY_CACHE_SIZE", "0")
+os.environ.setdefault("OUTLIER_CACHE_SIZE", "0")
+os.environ.setdefault("RELATED_NOTES_ENABLED", "false")
+
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import subprocess
+import tempfile
+import numpy as np
+from typing import Any, Awaitable, Callable, Dict, List
+from PIL import Image
+from benchmarks.corpus import TOPICS, generate_images, generate_notes, generate_sentence
+from commons.qdrant.qdrant_client import QDRANT_LOCAL_PATH, client, count_points
+from commons.qdrant.qdrant_helper import IMAGE_COLLECTION, NOTE_COLLECTION, ensure_collections, warmup_models
+from features.chunking.chunking_service import chunk_note
+from features.chunking.segmentation_service import warmup_segmentation
+from features.embedding.embedding_service import ImageInput, NoteInput, process_image, process_images, process_note, process_notes
+from features.search.search_service import search_notes
+from features.similarity.similarity_service import find_similar_images, find_similar_notes
+
+FILL_NOTE_BATCH_SIZE = 50
+FILL_IMAGE_BATCH_SIZE = 64
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    total = sum(latencies)
+    return {
+        "samples": len(latencies),
+        "mean_ms": float(np.mean(latencies)) * 1000 if latencies else 0.0,
+        "p50_ms": float(np.percentile(latencies, 50)) * 1000 if latencies else 0.0,
+        "p95_ms": float(np.percentile(latencies, 95)) * 1000 if latencies else 0.0,
+        "p99_ms": float(np.percentile(latencies, 99)) * 1000 if latencies else 0.0,
+        "ops_per_second": len(latencies) / total if total else 0.0,
+    }
+
+
+def measure(fn: Callable[..., Any], calls: List[tuple]) -> Dict[str, float]:
+    latencies = []
+    for args in calls:
+        start = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies)
+
+
+async def measure_async(fn: Callable[..., Awaitable[Any]], calls: List[tuple]) -> Dict[str, float]:
+    latencies = []
+    for args in calls:
+        start = time.perf_counter()
+        await fn(*args)
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies)
+
+
+def build_note(note_id: int, content: str) -> NoteInput:
+    return {"note_id": note_id, "title": f"Note {note_id}", "content": content, "tags": [f"tag{note_id % 10}"], "updated_at": "2024-01-01T00:00:00Z"}
+
+
+def build_image(image_path: str) -> ImageInput:
+    with Image.open(image_path) as image:
+        width, height, image_format = image.width, image.height, image.format
+    return {
+        "filename": os.path.basename(image_path),
+        "image_path": image_path,
+        "width": width,
+        "height": height,
+        "aspect_ratio": width / height,
+        "file_size": os.path.getsize(image_path),
+        "format": image_format,
+    }
+
+
+class Corpus:
+    # grows the collections across scales, note ids and image names continue where the last fill stopped
+    def __init__(self, image_dir: str):
+        self.image_dir = image_dir
+        self.note_ids: List[int] = []
+        self.filenames: List[str] = []
+        self.next_note_id = 0
+        self.next_image_index = 0
+
+    def next_notes(self, count: int) -> List[NoteInput]:
+        first_id = self.next_note_id
+        self.next_note_id += count
+        return [build_note(first_id + i, content) for i, content in enumerate(generate_notes(count, seed=first_id))]
+
+    def next_images(self, count: int) -> List[ImageInput]:
+        start = self.next_image_index
+        self.next_image_index += count
+        return [build_image(path) for path in generate_images(self.image_dir, count, start=start)]
+
+    def fill_notes(self, chunks: int) -> Dict[str, float]:
+        start = time.perf_counter()
+        notes = 0
+        added_chunks = 0
+        stored = count_points(NOTE_COLLECTION)
+        while stored < chunks:
+            batch = self.next_notes(FILL_NOTE_BATCH_SIZE)
+            added_chunks += sum(result["chunks"] for result in process_notes(batch))
+            self.note_ids.extend(note["note_id"] for note in batch)
+            notes += len(batch)
+            stored = count_points(NOTE_COLLECTION)
+        elapsed = time.perf_counter() - start
+        return {
+            "notes": notes,
+            "chunks": added_chunks,
+            "seconds": elapsed,
+            "notes_per_second": notes / elapsed if elapsed else 0.0,
+            "chunks_per_second": added_chunks / elapsed if elapsed else 0.0,
+        }
+
+    def fill_images(self, images: int) -> Dict[str, float]:
+        start = time.perf_counter()
+        added = 0
+        while len(self.filenames) < images:
+            batch = self.next_images(min(FILL_IMAGE_BATCH_SIZE, images - len(self.filenames)))
+            process_images(batch)
+            self.filenames.extend(image["filename"] for image in batch)
+            added += len(batch)
+        elapsed = time.perf_counter() - start
+        return {"images": added, "seconds": elapsed, "images_per_second": added / elapsed if elapsed else 0.0}
+
+
+def run_scale(corpus: Corpus, chunks: int, image_ratio: float, samples: int, rng: random.Random) -> Dict[str, Any]:
+    fill = {"notes": corpus.fill_notes(chunks), "images": corpus.fill_images(max(samples, int(chunks * image_ratio)))}
+    report: Dict[str, Any] = {"chunks": count_points(NOTE_COLLECTION), "notes": len(corpus.note_ids), "images": count_points(IMAGE_COLLECTION), "fill": fill, "operations": {}}
+    operations = report["operations"]
+
+    # reads first, the write samples add notes and images to the collections
+    queries = [(generate_sentence(rng, rng.choice(list(TOPICS))),) for _ in range(samples)]
+    note_ids = [(note_id,) for note_id in rng.choices(corpus.note_ids, k=samples)]
+    filenames = [(filename,) for filename in rng.choices(corpus.filenames, k=samples)]
+
+    operations["chunk_note"] = measure(chunk_note, [(note["content"],) for note in corpus.next_notes(samples)])
+    operations["search_notes"] = asyncio.run(measure_async(search_notes, queries))
+    operations["find_similar_notes"] = measure(find_similar_notes, note_ids)
+    operations["find_similar_images"] = asyncio.run(measure_async(find_similar_images, filenames))
+
+    notes = corpus.next_notes(samples)
+    operations["process_note"] = measure(lambda note: process_note(**note), [(note,) for note in notes])
+    corpus.note_ids.extend(note["note_id"] for note in notes)
+
+    images = corpus.next_images(samples)
+    operations["process_image"] = measure(lambda image: process_image(**image), [(image,) for image in images])
+    corpus.filenames.extend(image["filename"] for image in images)
+
+    return report
+
+
+def get_commit() -> str | None:
+    try:
+        repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo_dir, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def reset_collections() -> None:
+    for collection in client.get_collections().collections:
+        client.delete_collection(collection.name)
+    ensure_collections()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1000, 10000, 100000], help="note chunks in the collection at each measurement")
+    parser.add_argument("--image-ratio", type=float, default=0.1, help="images per note chunk")
+    parser.add_argument("--samples", type=int, default=50, help="timed calls per operation and scale")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    reset_collections()
+    warmup_segmentation()
+    warmup_models()
+
+    rng = random.Random(7)
+    report: Dict[str, Any] = {
+        "commit": get_commit(),
+        "python": sys.version.split()[0],
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "qdrant": QDRANT_LOCAL_PATH,
+        "samples": args.samples,
+        "scales": [],
+    }
+
+    with tempfile.TemporaryDirectory() as image_dir:
+        corpus = Corpus(image_dir)
+        for chunks in sorted(args.scales):
+            report["scales"].append(run_scale(corpus, chunks, args.image_ratio, args.samples, rng))
+            print(f"measured {chunks} chunks", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
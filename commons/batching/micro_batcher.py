@@ -0,0 +1,126 @@
+import time
+import queue
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Dict, List
+from commons.executors.lane_executor import LaneBusyError
+from commons.metrics.metrics import batch_size
+
+
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64]
+
+
+class MicroBatcher:
+    # collects concurrent submissions for up to max_wait_ms (or max_batch_size items) and runs them as one call
+    def __init__(self, name: str, run_batch: Callable[[List[Any]], List[Any]], max_batch_size: int, max_wait_ms: float, max_pending: int = 0):
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        # submit_async rejects items beyond max_pending waiting ones (0 for no limit), it holds no thread to bound them
+        self.max_pending = max_pending
+        self.queue: queue.Queue = queue.Queue()
+        self.thread: threading.Thread | None = None
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.batch_sizes = {bucket: 0 for bucket in BATCH_SIZE_BUCKETS}
+        self.total_wait = 0.0
+        self.max_observed_wait = 0.0
+        self.rejected = 0
+
+    async def submit_async(self, item: Any) -> Any:
+        # waits on the event loop, so concurrent requests fill a batch up to max_batch_size without a thread each
+        if self.max_pending and self.queue.qsize() >= self.max_pending:
+            with self.lock:
+                self.rejected += 1
+            raise LaneBusyError(f"{self.name} batcher is busy", status_code=429)
+
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put((item, future, time.monotonic()))
+        self.ensure_started()
+        return await future
+
+    def ensure_started(self) -> None:
+        if self.thread is not None:
+            return
+
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.loop, name=f"{self.name}-batcher", daemon=True)
+                self.thread.start()
+
+    def loop(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            deadline = batch[0][2] + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self.execute(batch)
+
+    def execute(self, batch: List[tuple]) -> None:
+        started = time.monotonic()
+        self.record(len(batch), [started - submitted_at for _, _, submitted_at in batch])
+        batch_size.observe(len(batch), (self.name,))
+
+        try:
+            results = self.run_batch([item for item, _, _ in batch])
+        except Exception as e:
+            logging.error(f"{self.name} batch of {len(batch)} failed: {e}")
+            for _, future, _ in batch:
+                resolve(future, exception=e)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            resolve(future, result=result)
+
+        if len(results) < len(batch):
+            # without a result the caller would wait forever
+            error = RuntimeError(f"{self.name} batch returned {len(results)} results for {len(batch)} items")
+            logging.error(str(error))
+            for _, future, _ in batch[len(results):]:
+                resolve(future, exception=error)
+
+    def record(self, size: int, waits: List[float]) -> None:
+        bucket = next((bucket for bucket in BATCH_SIZE_BUCKETS if size <= bucket), BATCH_SIZE_BUCKETS[-1])
+        with self.lock:
+            self.batches += 1
+            self.items += size
+            self.batch_sizes[bucket] += 1
+            self.total_wait += sum(waits)
+            self.max_observed_wait = max(self.max_observed_wait, *waits)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self.batches,
+                "items": self.items,
+                "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+                "batch_size_histogram": {f"le_{bucket}": count for bucket, count in self.batch_sizes.items()},
+                "mean_wait_ms": self.total_wait / self.items * 1000 if self.items else 0.0,
+                "max_wait_observed_ms": self.max_observed_wait * 1000,
+                "rejected": self.rejected,
+            }
+
+
+def resolve(future: asyncio.Future, result: Any = None, exception: BaseException | None = None) -> None:
+    # asyncio futures are not thread safe, they are resolved on their loop and skipped if the request was cancelled
+    future.get_loop().call_soon_threadsafe(resolve_on_loop, future, result, exception)
+
+
+def resolve_on_loop(future: asyncio.Future, result: Any, exception: BaseException | None) -> None:
+    if future.done():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
@@ -0,0 +1,125 @@
+import os
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+import numpy as np
+from typing import Any, Callable, Dict, List, Tuple
+
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.expanduser("~/.cache/zen-intelligence/embeddings.db"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "1000000"))
+EVICTION_FRACTION = 0.05
+QUERY_BATCH_SIZE = 500
+
+
+lock = threading.Lock()
+connection: sqlite3.Connection | None = None
+entry_count = 0
+stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def get_connection() -> sqlite3.Connection:
+    global connection, entry_count
+    if connection is None:
+        os.makedirs(os.path.dirname(EMBEDDING_CACHE_PATH) or ".", exist_ok=True)
+        connection = sqlite3.connect(EMBEDDING_CACHE_PATH, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used INTEGER NOT NULL) WITHOUT ROWID")
+        connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        entry_count = connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        logging.info(f"Opened embedding cache: {EMBEDDING_CACHE_PATH}")
+    return connection
+
+
+def cache_key(model_name: str, content: bytes) -> bytes:
+    return hashlib.sha256(model_name.encode("utf-8") + b"\0" + content).digest()
+
+
+def embed_with_cache(model_name: str, contents: List[bytes], inputs: List[Any], embed: Callable[[List[Any]], List[List[float]]]) -> List[List[float]]:
+    # contents identify each input (text bytes or file bytes), only cache misses are passed to embed
+    if not EMBEDDING_CACHE_ENABLED:
+        return embed(inputs)
+
+    keys = [cache_key(model_name, content) for content in contents]
+    vectors = get_vectors(keys)
+
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    with lock:
+        stats["hits"] += len(keys) - len(missing)
+        stats["misses"] += len(missing)
+
+    if missing:
+        computed = embed([inputs[i] for i in missing])
+        for i, vector in zip(missing, computed):
+            vectors[i] = vector
+        put_vectors([(keys[i], vector) for i, vector in zip(missing, computed)])
+
+    return vectors
+
+
+def get_vectors(keys: List[bytes]) -> List[List[float] | None]:
+    found: Dict[bytes, bytes] = {}
+    now = time.time_ns()
+
+    with lock:
+        db = get_connection()
+        for start in range(0, len(keys), QUERY_BATCH_SIZE):
+            batch = keys[start:start + QUERY_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = db.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch).fetchall()
+            found.update(rows)
+            if rows:
+                db.execute(f"UPDATE embeddings SET last_used = ? WHERE key IN ({','.join('?' * len(rows))})", [now, *(row[0] for row in rows)])
+
+    return [np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None for key in keys]
+
+
+def put_vectors(entries: List[Tuple[bytes, List[float]]]) -> None:
+    global entry_count
+    if not entries:
+        return
+
+    now = time.time_ns()
+    rows = [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in entries]
+
+    with lock:
+        db = get_connection()
+        changes = db.total_changes
+        db.execute("BEGIN")
+        db.executemany("INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows)
+        db.execute("COMMIT")
+        entry_count += db.total_changes - changes
+
+        if entry_count > EMBEDDING_CACHE_MAX_ENTRIES:
+            evict(db)
+
+
+def evict(db: sqlite3.Connection) -> None:
+    global entry_count
+    # other processes may share the file, so recount before evicting
+    count = db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    entry_count = count
+    if count <= EMBEDDING_CACHE_MAX_ENTRIES:
+        return
+
+    # evict a little more than needed so eviction does not run on every insert
+    to_evict = count - EMBEDDING_CACHE_MAX_ENTRIES + int(EMBEDDING_CACHE_MAX_ENTRIES * EVICTION_FRACTION)
+    db.execute("DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (to_evict,))
+    stats["evictions"] += to_evict
+    entry_count -= to_evict
+    logging.debug(f"Evicted {to_evict} entries from embedding cache")
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    with lock:
+        lookups = stats["hits"] + stats["misses"]
+        return {
+            "enabled": EMBEDDING_CACHE_ENABLED,
+            **stats,
+            "entries": entry_count,
+            "hit_rate": stats["hits"] / lookups if lookups else 0.0,
+        }
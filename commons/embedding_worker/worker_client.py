@@ -0,0 +1,81 @@
+import os
+import stat
+import atexit
+import tempfile
+import threading
+import numpy as np
+from multiprocessing import shared_memory
+from multiprocessing.connection import Client
+from typing import Any, List, Set
+
+
+# the socket lives in a directory only this user can enter, so no other user can connect to it or put their own
+# socket in its place. Both ends also prove they hold the authkey before anything is unpickled
+EMBEDDING_WORKER_DIR = os.getenv("EMBEDDING_WORKER_DIR", os.path.join(tempfile.gettempdir(), f"zen-embedding-workers-{os.getuid()}"))
+EMBEDDING_WORKER_SOCKET = os.path.join(EMBEDDING_WORKER_DIR, "workers.sock")
+# created by the pool when missing, point both sides at a mounted secret to share a key across users or containers
+EMBEDDING_WORKER_AUTHKEY_FILE = os.getenv("EMBEDDING_WORKER_AUTHKEY_FILE", os.path.join(EMBEDDING_WORKER_DIR, "authkey"))
+MIN_BUFFER_BYTES = 1024 * 1024
+
+
+# each thread reuses one shared memory buffer for the vectors the worker writes back, grown on demand
+buffers = threading.local()
+live_buffers: Set[shared_memory.SharedMemory] = set()
+live_buffers_lock = threading.Lock()
+
+
+def check_private_dir(path: str) -> None:
+    info = os.stat(path, follow_symlinks=False)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(f"{path} must be a directory owned by uid {os.getuid()} with mode 0700")
+
+
+def read_authkey() -> bytes:
+    # read per connection, the pool writes a new key when it starts without one
+    with open(EMBEDDING_WORKER_AUTHKEY_FILE, "rb") as file:
+        return file.read()
+
+
+def get_buffer(size: int) -> shared_memory.SharedMemory:
+    buffer: shared_memory.SharedMemory | None = getattr(buffers, "buffer", None)
+    if buffer is not None and buffer.size >= size:
+        return buffer
+
+    if buffer is not None:
+        release_buffer(buffer)
+
+    buffer = shared_memory.SharedMemory(create=True, size=max(size, MIN_BUFFER_BYTES))
+    buffers.buffer = buffer
+    with live_buffers_lock:
+        live_buffers.add(buffer)
+    return buffer
+
+
+def release_buffer(buffer: shared_memory.SharedMemory) -> None:
+    with live_buffers_lock:
+        live_buffers.discard(buffer)
+    buffer.close()
+    buffer.unlink()
+
+
+@atexit.register
+def release_buffers() -> None:
+    for buffer in list(live_buffers):
+        release_buffer(buffer)
+
+
+def embed_in_worker(model_name: str, inputs: List[Any], dim: int) -> List[List[float]]:
+    # inputs are pickled over the socket, the worker writes float32 vectors straight into this thread's buffer
+    if not inputs:
+        return []
+
+    buffer = get_buffer(len(inputs) * dim * 4)
+    check_private_dir(EMBEDDING_WORKER_DIR)
+    with Client(EMBEDDING_WORKER_SOCKET, family="AF_UNIX", authkey=read_authkey()) as connection:
+        connection.send((model_name, inputs, buffer.name, dim))
+        status, result = connection.recv()
+
+    if status != "ok":
+        raise RuntimeError(f"Embedding worker failed: {result}")
+
+    return np.frombuffer(buffer.buf, dtype=np.float32, count=len(inputs) * dim).reshape(len(inputs), dim).tolist()
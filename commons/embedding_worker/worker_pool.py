@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+import signal
+import logging
+import secrets
+import multiprocessing
+import numpy as np
+from multiprocessing import AuthenticationError, resource_tracker, shared_memory
+from multiprocessing.connection import Connection, Listener, wait
+from typing import List
+
+from commons.embedding_worker.worker_client import EMBEDDING_WORKER_AUTHKEY_FILE, EMBEDDING_WORKER_DIR, EMBEDDING_WORKER_SOCKET, check_private_dir, read_authkey
+from commons.qdrant.qdrant_helper import get_model, get_warmup_inputs, run_model
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s:%(name)s:%(message)s')
+
+# every process owns one copy of each model and runs one request at a time, so memory grows with
+# EMBEDDING_WORKERS (not with API workers) and WORKERS x THREADS should match the cores given to inference
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "2"))
+EMBEDDING_WORKER_THREADS = int(os.getenv("EMBEDDING_WORKER_THREADS", str(max(1, (os.cpu_count() or 1) // EMBEDDING_WORKERS))))
+RESTART_DELAY_SECONDS = 1
+
+
+def serve(listener: Listener, worker_index: int) -> None:
+    # models are loaded after the fork, ONNX runtime thread pools do not survive it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for model_name, inputs in get_warmup_inputs().items():
+        get_model(model_name, threads=EMBEDDING_WORKER_THREADS)
+        run_model(model_name, inputs)
+    logging.info(f"Embedding worker {worker_index} ready (pid {os.getpid()}, {EMBEDDING_WORKER_THREADS} threads)")
+
+    # all workers accept on the same socket, an idle worker picks up the next connection
+    while True:
+        try:
+            connection = listener.accept()
+        except (AuthenticationError, EOFError, OSError) as e:
+            logging.warning(f"Embedding worker {worker_index} rejected a connection: {e}")
+            continue
+        with connection:
+            handle(connection)
+
+
+def handle(connection: Connection) -> None:
+    try:
+        model_name, inputs, buffer_name, dim = connection.recv()
+    except EOFError:
+        return
+
+    try:
+        vectors = run_model(model_name, inputs)
+        if vectors.shape != (len(inputs), dim):
+            raise ValueError(f"{model_name} returned shape {vectors.shape}, expected {(len(inputs), dim)}")
+        write_vectors(buffer_name, vectors)
+        connection.send(("ok", len(inputs)))
+    except Exception as e:
+        logging.error(f"Embedding request for {model_name} failed: {e}")
+        connection.send(("error", str(e)))
+
+
+def write_vectors(buffer_name: str, vectors: np.ndarray) -> None:
+    buffer = shared_memory.SharedMemory(name=buffer_name)
+    # the client owns the buffer, keep this process's resource tracker from unlinking it on exit
+    resource_tracker.unregister(buffer._name, "shared_memory")
+    try:
+        np.ndarray(vectors.shape, dtype=np.float32, buffer=buffer.buf)[:] = vectors
+    finally:
+        buffer.close()
+
+
+def start_worker(context: multiprocessing.context.BaseContext, listener: Listener, worker_index: int) -> multiprocessing.Process:
+    process = context.Process(target=serve, args=(listener, worker_index), name=f"embedding-worker-{worker_index}", daemon=True)
+    process.start()
+    return process
+
+
+def prepare_socket_dir() -> bytes:
+    # returns the authkey, a missing key file is created with a random key readable by this user only
+    os.makedirs(EMBEDDING_WORKER_DIR, mode=0o700, exist_ok=True)
+    check_private_dir(EMBEDDING_WORKER_DIR)
+
+    if not os.path.exists(EMBEDDING_WORKER_AUTHKEY_FILE):
+        fd = os.open(EMBEDDING_WORKER_AUTHKEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as file:
+            file.write(secrets.token_bytes(32))
+    if os.path.exists(EMBEDDING_WORKER_SOCKET):
+        os.unlink(EMBEDDING_WORKER_SOCKET)
+    return read_authkey()
+
+
+def main() -> None:
+    authkey = prepare_socket_dir()
+    listener = Listener(EMBEDDING_WORKER_SOCKET, family="AF_UNIX", backlog=128, authkey=authkey)
+    context = multiprocessing.get_context("fork")
+    processes: List[multiprocessing.Process] = [start_worker(context, listener, i) for i in range(EMBEDDING_WORKERS)]
+    logging.info(f"Embedding worker pool listening on {EMBEDDING_WORKER_SOCKET} ({EMBEDDING_WORKERS} workers)")
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        while True:
+            wait([process.sentinel for process in processes])
+            for i, process in enumerate(processes):
+                if not process.is_alive():
+                    logging.warning(f"Embedding worker {i} exited with code {process.exitcode}, restarting")
+                    time.sleep(RESTART_DELAY_SECONDS)
+                    processes[i] = start_worker(context, listener, i)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        listener.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+
+class LaneBusyError(Exception):
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class Lane:
+    # a thread pool with a bounded queue, submissions beyond workers + queue_size are rejected immediately
+    def __init__(self, name: str, workers: int, queue_size: int, queue_timeout: float):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-lane")
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+        self.rejected = 0
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise LaneBusyError(f"{self.name} lane is busy", status_code=429)
+
+        with self.lock:
+            self.pending += 1
+
+        try:
+            future = self.executor.submit(self.execute, time.monotonic(), fn, args, kwargs)
+        except BaseException:
+            self.release(None)
+            raise
+
+        # the slot is freed when the work finishes, even if the awaiting request is cancelled
+        future.add_done_callback(self.release)
+        return await asyncio.wrap_future(future)
+
+    def execute(self, submitted_at: float, fn: Callable[..., Any], args: tuple, kwargs: Dict[str, Any]) -> Any:
+        waited = time.monotonic() - submitted_at
+        if waited > self.queue_timeout:
+            raise LaneBusyError(f"{self.name} lane queue wait exceeded {self.queue_timeout:.1f}s", status_code=503)
+
+        with self.lock:
+            self.running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def release(self, _future: Any) -> None:
+        with self.lock:
+            self.pending -= 1
+        self.slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "running": self.running,
+                "queued": self.pending - self.running,
+                "rejected": self.rejected,
+            }
+
+
+search_lane = Lane(
+    "search",
+    workers=int(os.getenv("SEARCH_WORKERS", "4")),
+    queue_size=int(os.getenv("SEARCH_QUEUE_SIZE", "32")),
+    queue_timeout=float(os.getenv("SEARCH_QUEUE_TIMEOUT", "5")),
+)
+ingest_lane = Lane(
+    "ingest",
+    workers=int(os.getenv("INGEST_WORKERS", "2")),
+    queue_size=int(os.getenv("INGEST_QUEUE_SIZE", "8")),
+    queue_timeout=float(os.getenv("INGEST_QUEUE_TIMEOUT", "60")),
+)
+
+
+async def run_search(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    return await search_lane.run(fn, *args, **kwargs)
+
+
+async def run_ingest(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    return await ingest_lane.run(fn, *args, **kwargs)
+
+
+def get_lane_stats() -> Dict[str, Dict[str, Any]]:
+    return {lane.name: lane.stats() for lane in (search_lane, ingest_lane)}
@@ -0,0 +1,176 @@
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+# dependency free Prometheus metrics, an observation is a bisect and a few additions under a per metric lock,
+# so the pipeline stays instrumented in production
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+Labels = Tuple[str, ...]
+
+
+class Metric:
+    def __init__(self, name: str, help: str, metric_type: str, label_names: Labels = ()):
+        self.name = name
+        self.help = help
+        self.metric_type = metric_type
+        self.label_names = label_names
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def collect(self) -> List[str]:
+        raise NotImplementedError
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.metric_type}"]
+
+    def format_labels(self, labels: Labels, extra: str = "") -> str:
+        pairs = [f'{name}="{escape(value)}"' for name, value in zip(self.label_names, labels)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter(Metric):
+    def __init__(self, name: str, help: str, label_names: Labels = ()):
+        super().__init__(name, help, "counter", label_names)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, labels: Labels = ()) -> None:
+        if not METRICS_ENABLED:
+            return
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def collect(self) -> List[str]:
+        with self.lock:
+            values = list(self.values.items())
+        return [f"{self.name}{self.format_labels(labels)} {format_value(value)}" for labels, value in values]
+
+
+class Gauge(Counter):
+    def __init__(self, name: str, help: str, label_names: Labels = ()):
+        super().__init__(name, help, label_names)
+        self.metric_type = "gauge"
+
+    def dec(self, amount: float = 1, labels: Labels = ()) -> None:
+        self.inc(-amount, labels)
+
+
+class Histogram(Metric):
+    def __init__(self, name: str, help: str, label_names: Labels = (), buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        super().__init__(name, help, "histogram", label_names)
+        self.buckets = buckets
+        # labels -> [count per bucket (last one is +Inf), sum]
+        self.values: Dict[Labels, List[Any]] = {}
+
+    def observe(self, value: float, labels: Labels = ()) -> None:
+        if not METRICS_ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def collect(self) -> List[str]:
+        with self.lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self.values.items()]
+
+        lines = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip([*self.buckets, "+Inf"], counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == "+Inf" else f'le="{format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{self.format_labels(labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self.format_labels(labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{self.format_labels(labels)} {cumulative}")
+        return lines
+
+
+class CallbackMetric(Metric):
+    # reads values kept elsewhere (cache and lane stats) when scraped instead of counting twice
+    def __init__(self, name: str, help: str, metric_type: str, label_names: Labels, read: Callable[[], Dict[Labels, float]]):
+        super().__init__(name, help, metric_type, label_names)
+        self.read = read
+
+    def collect(self) -> List[str]:
+        return [f"{self.name}{self.format_labels(labels)} {format_value(value)}" for labels, value in self.read().items()]
+
+
+registry: List[Metric] = []
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render() -> str:
+    # Prometheus text exposition format 0.0.4
+    lines = []
+    for metric in registry:
+        lines.extend(metric.header())
+        try:
+            lines.extend(metric.collect())
+        except Exception as e:
+            lines.append(f"# collecting {metric.name} failed: {escape(str(e))}")
+    return "\n".join(lines) + "\n"
+
+
+stage_duration = Histogram("zen_stage_duration_seconds", "Duration of embedding pipeline stages", ("stage",))
+qdrant_request_duration = Histogram("zen_qdrant_request_duration_seconds", "Duration of Qdrant calls", ("client", "operation"))
+qdrant_errors = Counter("zen_qdrant_errors_total", "Failed Qdrant calls", ("client", "operation"))
+processed_items = Counter("zen_processed_items_total", "Items passing through the pipeline", ("item",))
+batch_size = Histogram("zen_batch_size", "Inputs per model call or micro batch", ("batch",), SIZE_BUCKETS)
+requests_in_flight = Gauge("zen_http_requests_in_flight", "HTTP requests being handled")
+request_duration = Histogram("zen_http_request_duration_seconds", "Duration of HTTP requests", ("method", "route", "status"))
+
+
+@contextmanager
+def time_stage(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_duration.observe(time.perf_counter() - start, (stage,))
+
+
+def timed_stage(stage: str) -> Callable:
+    def decorator(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                stage_duration.observe(time.perf_counter() - start, (stage,))
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def time_qdrant(client: str, operation: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        qdrant_errors.inc(labels=(client, operation))
+        raise
+    finally:
+        qdrant_request_duration.observe(time.perf_counter() - start, (client, operation))
+
@@ -0,0 +1,32 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+from commons.metrics.metrics import request_duration, requests_in_flight
+
+
+class MetricsMiddleware:
+    # plain ASGI so streaming request and response bodies pass through untouched, requests are labelled
+    # by route template (/embed/notes/{note_id}) to keep the label set bounded
+    def __init__(self, app: Callable[..., Awaitable[None]]):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            requests_in_flight.dec()
+            route = scope.get("route")
+            request_duration.observe(time.perf_counter() - start, (scope["method"], route.path if route else "unmatched", str(status)))
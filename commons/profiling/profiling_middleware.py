@@ -0,0 +1,20 @@
+from typing import Any, Awaitable, Callable, Dict
+from commons.profiling import sampling_profiler
+
+
+class ProfilingMiddleware:
+    # marks requests picked by a request profile, without a profile this is one attribute read per request
+    def __init__(self, app: Callable[..., Awaitable[None]]):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        profile = sampling_profiler.current_profile
+        if profile is None or scope["type"] != "http" or not profile.matches(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile.request_started()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profile.request_finished()
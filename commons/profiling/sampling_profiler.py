@@ -0,0 +1,221 @@
+import os
+import re
+import sys
+import time
+import asyncio
+import threading
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+from starlette.routing import Match
+
+# admin only sampling profiler, off unless PROFILER_ADMIN_TOKEN is set. Nothing runs while no profile is taken,
+# a profile starts one thread that reads the stacks of all other threads with sys._current_frames()
+PROFILER_ADMIN_TOKEN = os.getenv("PROFILER_ADMIN_TOKEN", "")
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "120"))
+
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+# leaf frames of threads waiting for work (event loop, lane workers, batchers), dropped unless idle stacks are asked for
+IDLE_FRAMES = {("selectors.py", "select"), ("threading.py", "wait"), ("queue.py", "get"), ("thread.py", "_worker")}
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+Frame = Tuple[str, str, int]
+Stack = Tuple[Frame, ...]
+
+
+class ProfilerBusyError(Exception):
+    pass
+
+
+@lru_cache(maxsize=4096)
+def short_path(filename: str) -> str:
+    if "site-packages" + os.sep in filename:
+        return filename.split("site-packages" + os.sep, 1)[1]
+    if filename.startswith(REPO_ROOT + os.sep):
+        return os.path.relpath(filename, REPO_ROOT)
+    return os.path.basename(filename)
+
+
+def thread_group(name: str) -> str:
+    # pool threads (search-lane_0, asyncio_3) are merged into one group
+    return re.sub(r"_\d+$", "", name)
+
+
+def format_frame(frame: Frame) -> str:
+    function, filename, line = frame
+    return f"{function} ({short_path(filename)}:{line})"
+
+
+class SamplingProfiler:
+    # samples while active is set, request profiles clear it between profiled requests
+    def __init__(self, interval_ms: float = PROFILER_INTERVAL_MS, include_idle: bool = False):
+        self.interval = interval_ms / 1000
+        self.include_idle = include_idle
+        self.counts: Counter = Counter()
+        self.seconds: Dict[Tuple[str, Stack], float] = {}
+        self.samples = 0
+        self.active = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.loop, name="sampling-profiler", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.active.set()
+        self.thread.join()
+
+    def loop(self) -> None:
+        own_id = threading.get_ident()
+        last = None
+        while True:
+            if not self.active.is_set():
+                last = None
+                # the timeout covers a request finishing (and clearing active) right after stop()
+                while not self.active.wait(0.1) and not self.stopped.is_set():
+                    pass
+            if self.stopped.is_set():
+                return
+            now = time.perf_counter()
+            # weight by the time since the last sample, the sampler gets fewer turns when the GIL is contended
+            self.sample(own_id, self.interval if last is None else now - last)
+            last = now
+            self.stopped.wait(self.interval)
+
+    def sample(self, own_id: int, elapsed: float) -> None:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_qualname, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if not self.include_idle and (os.path.basename(stack[0][1]), stack[0][0].rsplit(".", 1)[-1]) in IDLE_FRAMES:
+                continue
+
+            key = (thread_group(names.get(thread_id, str(thread_id))), tuple(reversed(stack)))
+            self.counts[key] += 1
+            self.seconds[key] = self.seconds.get(key, 0.0) + elapsed
+        self.samples += 1
+
+    def to_collapsed(self) -> str:
+        # Brendan Gregg's folded format, one "thread;outer;...;inner count" line per distinct stack
+        lines = [";".join([thread, *map(format_frame, stack)]) + f" {count}" for (thread, stack), count in self.counts.items()]
+        return "\n".join(sorted(lines)) + "\n"
+
+    def to_speedscope(self, name: str) -> Dict[str, Any]:
+        frames: List[Dict[str, Any]] = []
+        frame_indexes: Dict[Frame, int] = {}
+        profiles: Dict[str, Dict[str, Any]] = {}
+
+        for (thread, stack), seconds in self.seconds.items():
+            indexes = []
+            for frame in stack:
+                if frame not in frame_indexes:
+                    frame_indexes[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": short_path(frame[1]), "line": frame[2]})
+                indexes.append(frame_indexes[frame])
+
+            profile = profiles.setdefault(thread, {"type": "sampled", "name": thread, "unit": "milliseconds", "startValue": 0, "endValue": 0, "samples": [], "weights": []})
+            profile["samples"].append(indexes)
+            profile["weights"].append(seconds * 1000)
+            profile["endValue"] += seconds * 1000
+
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": name,
+            "exporter": "zen-intelligence",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": sorted(profiles.values(), key=lambda profile: -profile["endValue"]),
+        }
+
+
+class RequestProfile:
+    # profiles the next count requests to a route template, sampling only while one of them is in flight.
+    # Other requests running at the same time are sampled too, their threads are not told apart
+    def __init__(self, route: str, count: int, profiler: SamplingProfiler):
+        self.route = route
+        self.remaining = count
+        self.count = count
+        self.in_flight = 0
+        self.finished = 0
+        self.profiler = profiler
+        self.done = asyncio.Event()
+
+    def matches(self, scope: Dict[str, Any]) -> bool:
+        if self.remaining == 0:
+            return False
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", None) == self.route
+        return False
+
+    def request_started(self) -> None:
+        # runs on the event loop like request_finished, so the counters need no lock
+        self.remaining -= 1
+        self.in_flight += 1
+        self.profiler.active.set()
+
+    def request_finished(self) -> None:
+        self.in_flight -= 1
+        self.finished += 1
+        if self.in_flight == 0:
+            self.profiler.active.clear()
+        if self.finished == self.count:
+            self.done.set()
+
+
+profile_lock = threading.Lock()
+current_profile: RequestProfile | None = None
+
+
+def acquire_profiler(interval_ms: float, include_idle: bool) -> SamplingProfiler:
+    # one profile at a time, two samplers would each slow the process down and show up in the other's stacks
+    if not profile_lock.acquire(blocking=False):
+        raise ProfilerBusyError("a profile is already running")
+    profiler = SamplingProfiler(interval_ms, include_idle)
+    profiler.start()
+    return profiler
+
+
+def release_profiler(profiler: SamplingProfiler) -> None:
+    try:
+        profiler.stop()
+    finally:
+        profile_lock.release()
+
+
+async def profile_for(seconds: float, interval_ms: float = PROFILER_INTERVAL_MS, include_idle: bool = False) -> SamplingProfiler:
+    profiler = acquire_profiler(interval_ms, include_idle)
+    try:
+        profiler.active.set()
+        await asyncio.sleep(seconds)
+    finally:
+        await asyncio.to_thread(release_profiler, profiler)
+    return profiler
+
+
+async def profile_requests(route: str, count: int, timeout: float, interval_ms: float = PROFILER_INTERVAL_MS, include_idle: bool = False) -> Tuple[SamplingProfiler, int]:
+    # returns what was sampled when timeout passes before count requests finished, with the number that did
+    global current_profile
+    profiler = acquire_profiler(interval_ms, include_idle)
+    profile = RequestProfile(route, count, profiler)
+    try:
+        current_profile = profile
+        try:
+            await asyncio.wait_for(profile.done.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+    finally:
+        current_profile = None
+        await asyncio.to_thread(release_profiler, profiler)
+    return profiler, profile.finished
@@ -0,0 +1,75 @@
+import os
+from typing import Dict, TypedDict
+from qdrant_client.models import (BinaryQuantization, BinaryQuantizationConfig, Distance, HnswConfigDiff, QuantizationSearchParams, ScalarQuantization,
+                                  ScalarQuantizationConfig, ScalarType, SearchParams, VectorParams)
+from commons.qdrant.matryoshka import FULL_VECTOR, SHORT_VECTOR
+
+
+QUANTIZATIONS = ("none", "scalar", "binary")
+
+
+class CollectionProfile(TypedDict):
+    quantization: str
+    on_disk: bool
+    hnsw_m: int
+    hnsw_ef_construct: int
+    oversampling: float
+    rescore: bool
+
+
+def load_profile() -> CollectionProfile:
+    # applies to collections created from now on, existing ones change through the migration tool
+    profile: CollectionProfile = {
+        "quantization": os.getenv("QDRANT_QUANTIZATION", "none"),
+        "on_disk": os.getenv("QDRANT_ON_DISK", "false").lower() == "true",
+        "hnsw_m": int(os.getenv("QDRANT_HNSW_M", "16")),
+        "hnsw_ef_construct": int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", "100")),
+        "oversampling": float(os.getenv("QDRANT_OVERSAMPLING", "2.0")),
+        "rescore": os.getenv("QDRANT_RESCORE", "true").lower() == "true",
+    }
+    validate_profile(profile)
+    return profile
+
+
+def validate_profile(profile: CollectionProfile) -> None:
+    if profile["quantization"] not in QUANTIZATIONS:
+        raise ValueError(f"Invalid QDRANT_QUANTIZATION: {profile['quantization']} (expected one of {', '.join(QUANTIZATIONS)})")
+
+
+def build_vectors_config(vector_size: int, profile: CollectionProfile, short_vector_dim: int = 0) -> VectorParams | Dict[str, VectorParams]:
+    # quantized vectors stay in RAM, with on_disk only the full vectors used for rescoring are read from disk
+    if short_vector_dim:
+        return build_two_stage_vectors_config(vector_size, profile, short_vector_dim)
+
+    quantization_config = None
+    if profile["quantization"] == "scalar":
+        quantization_config = ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True))
+    elif profile["quantization"] == "binary":
+        quantization_config = BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+
+    return VectorParams(
+        size=vector_size,
+        distance=Distance.COSINE,
+        on_disk=profile["on_disk"],
+        hnsw_config=HnswConfigDiff(m=profile["hnsw_m"], ef_construct=profile["hnsw_ef_construct"]),
+        quantization_config=quantization_config,
+    )
+
+
+def build_two_stage_vectors_config(vector_size: int, profile: CollectionProfile, short_vector_dim: int) -> Dict[str, VectorParams]:
+    # the profile's index, quantization and RAM placement apply to the short vector, the full vector gets no HNSW
+    # graph (m=0) since it is only read to rescore candidates
+    short_profile: CollectionProfile = {**profile, "on_disk": False}
+    return {
+        SHORT_VECTOR: build_vectors_config(short_vector_dim, short_profile),
+        FULL_VECTOR: VectorParams(size=vector_size, distance=Distance.COSINE, on_disk=profile["on_disk"], hnsw_config=HnswConfigDiff(m=0)),
+    }
+
+
+def build_search_params(profile: CollectionProfile) -> SearchParams | None:
+    # ignored by Qdrant for collections without quantization, so it is safe while a migration is pending
+    if profile["quantization"] == "none":
+        return None
+
+    return SearchParams(quantization=QuantizationSearchParams(rescore=profile["rescore"], oversampling=profile["oversampling"]))
+
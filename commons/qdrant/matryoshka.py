@@ -0,0 +1,24 @@
+import numpy as np
+from typing import Any, Dict, List
+
+# two stage layout: the HNSW index is built over a short Matryoshka prefix of each embedding and finds candidates,
+# the full vector is stored without an index and only rescores them
+FULL_VECTOR = "full"
+SHORT_VECTOR = "short"
+
+
+def truncate_embedding(vector: List[float], dim: int) -> List[float]:
+    # nomic-embed-text-v1.5 recipe: layer norm over the full embedding, truncate, normalize. The layer norm has no
+    # affine weights and its scaling cancels out in the final normalization, so only the mean is removed
+    values = np.asarray(vector, dtype=np.float32)
+    prefix = (values - values.mean())[:dim]
+    return (prefix / np.linalg.norm(prefix)).tolist()
+
+
+def build_named_vectors(vector: List[float], short_dim: int) -> Dict[str, List[float]]:
+    return {FULL_VECTOR: vector, SHORT_VECTOR: truncate_embedding(vector, short_dim)}
+
+
+def full_vector(vector: Any) -> Any:
+    # points read back from a two stage collection carry both vectors, callers only deal with the full one
+    return vector.get(FULL_VECTOR) if isinstance(vector, dict) else vector
@@ -0,0 +1,193 @@
+"""Rebuilds the collection behind an alias with a new layout and switches reads over without downtime.
+
+The service only talks to the `notes` / `images` aliases. This copies every
+point of the collection the alias points at into a new collection created
+with the requested profile (quantization, on-disk vectors, HNSW parameters),
+repeats catch-up passes for writes made during the copy, waits for the new
+collection to finish indexing and then moves the alias in one atomic
+operation. The old collection is kept for rollback unless --drop-source is
+given.
+
+--short-vector-dim switches to (or resizes) the two stage layout, where HNSW
+indexes a Matryoshka prefix of each vector and the full vector only rescores
+candidates; 0 goes back to a single indexed vector. The target keeps the
+source's layout when it is not given.
+
+    uv run python -m commons.qdrant.migrate_collection notes --target notes_v2 --quantization scalar --on-disk
+    uv run python -m commons.qdrant.migrate_collection notes --target notes_v3 --short-vector-dim 256
+    uv run python -m commons.qdrant.migrate_collection notes --rollback notes_v1
+
+Writes are not paused. Catch-up passes compare every point's id and a
+digest of its small payload fields (content_hash covers the chunk text and
+the image bytes) and copy new or changed points with their vectors. Writes
+and deletes that land on the old collection between the last pass and the
+alias switch are applied by a final pass that diffs the old collection
+against that last pass, so writes made to the new collection after the
+switch are left alone. Running
+services cache the layout behind the alias; when Qdrant rejects a search or
+write for its vectors after a layout change, they read the layout again and
+retry the request once.
+"""
+import sys
+import json
+import time
+import hashlib
+import argparse
+import logging
+from typing import Any, Dict, List, Tuple
+from qdrant_client.models import CollectionStatus
+from commons.qdrant.collection_profile import CollectionProfile, load_profile, validate_profile
+from commons.qdrant.qdrant_client import (client, create_collection_if_not_exists, create_payload_indexes, delete_points, get_alias_target, read_short_vector_dim,
+                                          read_vector_size, retrieve_points, scroll_points, switch_alias, upsert_points)
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s:%(name)s:%(message)s')
+
+COPY_BATCH_SIZE = 256
+MAX_CATCH_UP_PASSES = 5
+INDEXING_POLL_SECONDS = 2
+# payload fields compared between the collections, the chunk text is left out since content_hash covers it
+COMPARED_PAYLOAD = ["note_id", "title", "tags", "updated_at", "content_hash", "chunk_index", "filename", "width", "height", "aspectRatio", "fileSize", "format"]
+
+
+def build_profile(args: argparse.Namespace) -> CollectionProfile:
+    # unset options keep the QDRANT_* environment settings
+    profile = load_profile()
+    overrides = {
+        "quantization": args.quantization,
+        "on_disk": args.on_disk,
+        "hnsw_m": args.hnsw_m,
+        "hnsw_ef_construct": args.hnsw_ef_construct,
+    }
+    profile.update({key: value for key, value in overrides.items() if value is not None})
+    validate_profile(profile)
+    return profile
+
+
+def create_target(source: str, target: str, profile: CollectionProfile, short_vector_dim: int | None) -> None:
+    # points are copied with their full vector, upsert_points derives the short one when the target has it
+    source_info = client.get_collection(source)
+    vectors_config = source_info.config.params.vectors
+    if short_vector_dim is None:
+        short_vector_dim = read_short_vector_dim(vectors_config)
+    create_collection_if_not_exists(target, read_vector_size(vectors_config), profile, short_vector_dim)
+    create_payload_indexes(target, {field_name: index.data_type for field_name, index in source_info.payload_schema.items()})
+
+
+def copy_points(source: str, target: str) -> int:
+    copied = 0
+    batch = []
+    for point in scroll_points(source, {}, with_vectors=True):
+        batch.append(point)
+        if len(batch) >= COPY_BATCH_SIZE:
+            upsert_points(target, batch)
+            copied += len(batch)
+            batch = []
+
+    if batch:
+        upsert_points(target, batch)
+        copied += len(batch)
+
+    return copied
+
+
+def load_digests(collection_name: str) -> Dict[str, bytes]:
+    # id -> digest of the compared payload fields, a few dozen bytes per point for collections with millions of points
+    return {point["id"]: payload_digest(point["payload"]) for point in scroll_points(collection_name, {}, with_payload=COMPARED_PAYLOAD)}
+
+
+def payload_digest(payload: Dict[str, Any]) -> bytes:
+    return hashlib.blake2b(json.dumps(payload, sort_keys=True, default=str).encode("utf-8"), digest_size=16).digest()
+
+
+def copy_by_id(source: str, target: str, point_ids: List[str]) -> None:
+    # with vectors, an image embedded again keeps its id but gets a new vector
+    for start in range(0, len(point_ids), COPY_BATCH_SIZE):
+        upsert_points(target, retrieve_points(source, point_ids[start:start + COPY_BATCH_SIZE], with_vectors=True))
+
+
+def sync_points(source: str, target: str, source_digests: Dict[str, bytes], target_digests: Dict[str, bytes]) -> int:
+    changed = [point_id for point_id, digest in source_digests.items() if target_digests.get(point_id) != digest]
+    removed = [point_id for point_id in target_digests if point_id not in source_digests]
+
+    copy_by_id(source, target, changed)
+    delete_points(target, removed)
+
+    logging.info(f"Catch-up: {len(changed)} copied, {len(removed)} removed")
+    return len(changed) + len(removed)
+
+
+def catch_up(source: str, target: str) -> Tuple[Dict[str, bytes], int]:
+    # returns the source digests the pass worked from, with the number of points copied or removed
+    source_digests = load_digests(source)
+    return source_digests, sync_points(source, target, source_digests, load_digests(target))
+
+
+def wait_until_indexed(collection_name: str) -> None:
+    while client.get_collection(collection_name).status != CollectionStatus.GREEN:
+        logging.info(f"Waiting for {collection_name} to finish indexing")
+        time.sleep(INDEXING_POLL_SECONDS)
+
+
+def migrate(alias: str, target: str, profile: CollectionProfile, short_vector_dim: int | None, drop_source: bool) -> None:
+    source = get_alias_target(alias)
+    if source is None:
+        raise ValueError(f"Alias {alias} does not exist")
+    if source == target:
+        raise ValueError(f"Alias {alias} already points at {target}")
+    if client.collection_exists(target):
+        raise ValueError(f"Collection {target} already exists, delete it or pick another name")
+
+    logging.info(f"Migrating {alias}: {source} -> {target} with {profile}")
+    create_target(source, target, profile, short_vector_dim)
+
+    started = time.time()
+    copied = copy_points(source, target)
+    logging.info(f"Copied {copied} points in {time.time() - started:.1f}s")
+
+    for _ in range(MAX_CATCH_UP_PASSES):
+        if catch_up(source, target)[1] == 0:
+            break
+
+    wait_until_indexed(target)
+    last_pass, _ = catch_up(source, target)
+    switch_alias(alias, target)
+
+    # writes and deletes that reached the old collection after the last pass, diffed against that pass rather than
+    # the target, which takes the service's writes from now on
+    late_writes = sync_points(source, target, load_digests(source), last_pass)
+    logging.info(f"Switched {alias} to {target}, applied {late_writes} late writes")
+
+    if drop_source:
+        client.delete_collection(source)
+        logging.info(f"Deleted {source}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("alias", help="alias to migrate, e.g. notes or images")
+    parser.add_argument("--target", help="name of the new collection, e.g. notes_v2")
+    parser.add_argument("--rollback", metavar="COLLECTION", help="point the alias back at an existing collection instead of migrating")
+    parser.add_argument("--quantization", choices=["none", "scalar", "binary"])
+    parser.add_argument("--on-disk", action=argparse.BooleanOptionalAction, default=None, help="keep full vectors on disk")
+    parser.add_argument("--hnsw-m", type=int)
+    parser.add_argument("--hnsw-ef-construct", type=int)
+    parser.add_argument("--short-vector-dim", type=int, help="size of the indexed Matryoshka prefix, 0 for a single full vector")
+    parser.add_argument("--drop-source", action="store_true", help="delete the old collection after the switch")
+    args = parser.parse_args()
+
+    if args.rollback:
+        switch_alias(args.alias, args.rollback)
+        return
+
+    if not args.target:
+        parser.error("--target or --rollback is required")
+
+    try:
+        migrate(args.alias, args.target, build_profile(args), args.short_vector_dim, args.drop_source)
+    except ValueError as e:
+        logging.error(str(e))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import os
+import asyncio
+import logging
+import grpc
+import httpx
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, TypeVar
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http.exceptions import ResponseHandlingException
+from qdrant_client.models import FilterSelector, PointIdsList, PointStruct
+from commons.metrics.metrics import time_qdrant
+from commons.qdrant.matryoshka import full_vector
+from commons.qdrant.qdrant_client import (MAX_PREFETCH_CANDIDATES, PREFETCH_MULTIPLIER, QDRANT_LOCAL_PATH, SCROLL_PAGE_SIZE, SEARCH_BATCH_SIZE, build_filter, build_query, build_query_request,
+                                          bump_collection_version, client, is_layout_error, read_short_vector_dim, to_point_vector, url, vector_layouts)
+
+# the async counterpart of qdrant_client.py for code running on the event loop, CPU bound work (ingest, the
+# related notes worker, CLI tools) keeps the sync client
+
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "true").lower() == "true"
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+QDRANT_POOL_SIZE = int(os.getenv("QDRANT_POOL_SIZE", "32"))
+QDRANT_DEADLINE_SECONDS = float(os.getenv("QDRANT_DEADLINE_SECONDS", "10"))
+QDRANT_RETRIES = int(os.getenv("QDRANT_RETRIES", "2"))
+QDRANT_RETRY_BACKOFF_SECONDS = float(os.getenv("QDRANT_RETRY_BACKOFF_SECONDS", "0.05"))
+
+RETRYABLE_GRPC_CODES = {grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED, grpc.StatusCode.RESOURCE_EXHAUSTED}
+
+T = TypeVar("T")
+
+# candidates per group in a two stage group search, a note contributes several chunks to the candidates
+GROUP_PREFETCH_CHUNKS = 4
+# most groups a two stage group search can fill before build_query caps its candidates, deeper pages would be cut short
+MAX_GROUP_WINDOW = MAX_PREFETCH_CANDIDATES // (GROUP_PREFETCH_CHUNKS * PREFETCH_MULTIPLIER)
+
+
+class LocalAsyncClient:
+    # local mode keeps the points inside the sync client, so with QDRANT_LOCAL_PATH the async calls run it on a thread
+    def __init__(self, local_client: Any):
+        self.local_client = local_client
+
+    def __getattr__(self, name: str) -> Callable[..., Awaitable[Any]]:
+        method = getattr(self.local_client, name)
+
+        async def run(*args: Any, **kwargs: Any) -> Any:
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return run
+
+
+# gRPC multiplexes all calls over one HTTP/2 channel, REST (QDRANT_PREFER_GRPC=false) uses a pool of
+# QDRANT_POOL_SIZE connections, both are bound to the event loop that created them
+async_client: AsyncQdrantClient | LocalAsyncClient | None = None
+async_client_loop: asyncio.AbstractEventLoop | None = None
+
+
+def get_async_client() -> AsyncQdrantClient | LocalAsyncClient:
+    global async_client, async_client_loop
+    loop = asyncio.get_running_loop()
+    if QDRANT_LOCAL_PATH:
+        if async_client is None:
+            async_client = LocalAsyncClient(client)
+        return async_client
+
+    if async_client is None or async_client_loop is not loop:
+        async_client = AsyncQdrantClient(
+            url=url,
+            prefer_grpc=QDRANT_PREFER_GRPC,
+            grpc_port=QDRANT_GRPC_PORT,
+            timeout=int(QDRANT_DEADLINE_SECONDS),
+            limits=httpx.Limits(max_connections=QDRANT_POOL_SIZE, max_keepalive_connections=QDRANT_POOL_SIZE),
+        )
+        async_client_loop = loop
+    return async_client
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, grpc.aio.AioRpcError):
+        return error.code() in RETRYABLE_GRPC_CODES
+    return isinstance(error, (asyncio.TimeoutError, httpx.TransportError, ResponseHandlingException))
+
+
+async def call(operation: str, fn: Callable[[AsyncQdrantClient], Awaitable[T]], deadline: float = QDRANT_DEADLINE_SECONDS) -> T:
+    # every attempt gets its own deadline, all operations used here are idempotent so they can be retried,
+    # the recorded duration includes retries
+    with time_qdrant("async", operation):
+        for attempt in range(QDRANT_RETRIES + 1):
+            try:
+                return await asyncio.wait_for(fn(get_async_client()), timeout=deadline)
+            except Exception as e:
+                if attempt == QDRANT_RETRIES or not is_retryable(e):
+                    raise
+                delay = QDRANT_RETRY_BACKOFF_SECONDS * 2 ** attempt
+                logging.warning(f"qdrant {operation} failed ({type(e).__name__}), retrying in {delay * 1000:.0f}ms")
+                await asyncio.sleep(delay)
+
+
+def to_results(results: List[Any]) -> List[Dict[str, Any]]:
+    return [{"id": str(result.id), "score": float(result.score), "payload": result.payload or {}} for result in results]
+
+
+async def get_short_vector_dim(collection_name: str) -> int:
+    # shares the layout cache of the sync client
+    short_vector_dim = vector_layouts.get(collection_name)
+    if short_vector_dim is None:
+        collection = await call("get_collection", lambda c: c.get_collection(collection_name))
+        short_vector_dim = read_short_vector_dim(collection.config.params.vectors)
+        vector_layouts.set(collection_name, short_vector_dim)
+    return short_vector_dim
+
+
+async def with_vector_layout(collection_name: str, fn: Callable[[int], Awaitable[T]]) -> T:
+    # see qdrant_client.with_vector_layout, a request rejected for its vectors re-reads the layout and is retried once
+    try:
+        return await fn(await get_short_vector_dim(collection_name))
+    except Exception as e:
+        if not is_layout_error(e):
+            raise
+        logging.info(f"vector layout of {collection_name} changed, reading it again: {e}")
+        vector_layouts.delete(collection_name)
+        return await fn(await get_short_vector_dim(collection_name))
+
+
+async def upsert_points(collection_name: str, points: List[Dict[str, Any]]) -> None:
+    async def upsert(short_vector_dim: int) -> None:
+        point_structs = [PointStruct(id=point["id"], vector=to_point_vector(point["vector"], short_vector_dim), payload=point["payload"]) for point in points]
+        await call("upsert", lambda c: c.upsert(collection_name=collection_name, points=point_structs))
+
+    await with_vector_layout(collection_name, upsert)
+    bump_collection_version(collection_name)
+
+
+async def search_similar(collection_name: str, query_vector: List[float], limit: int = 20, threshold: float = 0.5) -> List[Dict[str, Any]]:
+    return await search_similar_with_filter(collection_name, query_vector, {}, limit, threshold)
+
+
+async def search_similar_with_filter(collection_name: str, query_vector: List[float], filter: Dict[str, Any], limit: int = 20, threshold: float = 0.5) -> List[Dict[str, Any]]:
+    search_filter = build_filter(filter) if filter else None
+
+    async def search(short_vector_dim: int) -> Any:
+        query = build_query(query_vector, short_vector_dim, limit * PREFETCH_MULTIPLIER, search_filter)
+        return await call("search", lambda c: c.query_points(collection_name=collection_name, **query, limit=limit, score_threshold=threshold))
+
+    response = await with_vector_layout(collection_name, search)
+    return to_results(response.points)
+
+
+async def search_similar_batch(collection_name: str, query_vectors: List[List[float]], limit: int = 20, threshold: float = 0.5, filter: Dict[str, Any] | None = None, exclude: Dict[str, Any] | None = None) -> List[List[Dict[str, Any]]]:
+    if not query_vectors:
+        return []
+
+    search_filter = build_filter(filter or {}, exclude) if filter or exclude else None
+
+    async def search_batch(short_vector_dim: int, batch: List[List[float]]) -> Any:
+        requests = [build_query_request(query_vector, short_vector_dim, limit, threshold, search_filter) for query_vector in batch]
+        return await call("search_batch", lambda c: c.query_batch_points(collection_name=collection_name, requests=requests))
+
+    # one request per SEARCH_BATCH_SIZE query vectors
+    batch_results = []
+    for start in range(0, len(query_vectors), SEARCH_BATCH_SIZE):
+        batch = query_vectors[start:start + SEARCH_BATCH_SIZE]
+        batch_results.extend(await with_vector_layout(collection_name, lambda short_vector_dim: search_batch(short_vector_dim, batch)))
+    return [to_results(response.points) for response in batch_results]
+
+
+async def search_groups(collection_name: str, query_vector: List[float], group_by: str, limit: int = 20, offset: int = 0, group_size: int = 1, threshold: float = 0.5, filter: Dict[str, Any] | None = None) -> List[Dict[str, Any]]:
+    # best group_size hits per distinct group_by value, Qdrant has no group offset so earlier pages are fetched and dropped
+    search_filter = build_filter(filter) if filter else None
+    groups = offset + limit
+    # build_query caps the candidates at MAX_PREFETCH_CANDIDATES
+    candidates = groups * max(group_size, GROUP_PREFETCH_CHUNKS) * PREFETCH_MULTIPLIER
+
+    async def search(short_vector_dim: int) -> Any:
+        query = build_query(query_vector, short_vector_dim, candidates, search_filter)
+        return await call("search_groups", lambda c: c.query_points_groups(
+            collection_name=collection_name,
+            group_by=group_by,
+            **query,
+            limit=groups,
+            group_size=group_size,
+            score_threshold=threshold,
+            with_payload=True,
+        ))
+
+    response = await with_vector_layout(collection_name, search)
+    return [{"group_id": group.id, "hits": to_results(group.hits)} for group in response.groups[offset:]]
+
+
+async def scroll_points(collection_name: str, filter_conditions: Dict[str, Any], limit: int | None = None, with_vectors: bool = False, with_payload: bool | List[str] = True, page_size: int = SCROLL_PAGE_SIZE) -> AsyncIterator[Dict[str, Any]]:
+    search_filter = build_filter(filter_conditions)
+    offset = None
+    remaining = limit
+
+    while remaining is None or remaining > 0:
+        page_limit = page_size if remaining is None else min(page_size, remaining)
+        results, offset = await call("scroll", lambda c: c.scroll(collection_name=collection_name, scroll_filter=search_filter, limit=page_limit, offset=offset, with_payload=with_payload, with_vectors=with_vectors))
+
+        for result in results:
+            yield {"id": str(result.id), "payload": result.payload or {}, "vector": full_vector(result.vector) if with_vectors else None}
+
+        if remaining is not None:
+            remaining -= len(results)
+        if offset is None:
+            return
+
+
+async def retrieve_points(collection_name: str, point_ids: List[int | str], with_vectors: bool = False) -> List[Dict[str, Any]]:
+    results = await call("retrieve", lambda c: c.retrieve(collection_name=collection_name, ids=point_ids, with_payload=True, with_vectors=with_vectors))
+    return [{"id": str(result.id), "payload": result.payload or {}, "vector": full_vector(result.vector) if with_vectors else None} for result in results]
+
+
+async def delete_points(collection_name: str, point_ids: List[str]) -> None:
+    if not point_ids:
+        return
+
+    await call("delete", lambda c: c.delete(collection_name=collection_name, points_selector=PointIdsList(points=point_ids)))
+    bump_collection_version(collection_name)
+
+
+async def delete_points_by_filter(collection_name: str, filter_conditions: Dict[str, Any]) -> None:
+    selector = FilterSelector(filter=build_filter(filter_conditions))
+    await call("delete", lambda c: c.delete(collection_name=collection_name, points_selector=selector))
+    bump_collection_version(collection_name)
+    logging.debug(f"Deleted points matching {filter_conditions} from {collection_name}")
+
+
+async def health_check() -> bool:
+    try:
+        await call("health", lambda c: c.get_collections(), deadline=5)
+        return True
+    except Exception as e:
+        logging.error(f"qdrant health check failed: {e}")
+        return False
@@ -1,33 +1,226 @@
 import os
+import re
 import logging
-from typing import List, Dict, Any
+from typing import Callable, List, Dict, Any, Iterator, Tuple, TypeVar
 from qdrant_client.qdrant_client import QdrantClient
-from qdrant_client.models import (Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue)
+from qdrant_client.http.exceptions import UnexpectedResponse
+from qdrant_client.models import (PointStruct, Filter, FieldCondition, FilterSelector, MatchValue, MatchAny, DatetimeRange, Range, PayloadSchemaType, PointIdsList, Prefetch, QueryRequest, SetPayload,
+                                  SetPayloadOperation, CreateAlias, CreateAliasOperation, DeleteAlias, DeleteAliasOperation, VectorParams)
+from commons.cache.ttl_cache import TTLCache
+from commons.metrics.metrics import time_qdrant
+from commons.qdrant.collection_profile import CollectionProfile, build_search_params, build_vectors_config, load_profile
+from commons.qdrant.matryoshka import FULL_VECTOR, SHORT_VECTOR, build_named_vectors, full_vector, truncate_embedding
 
 
 url = os.getenv("QDRANT_URL", "http://localhost:6333")
-client = QdrantClient(url=url, timeout=30)
+# ":memory:" or a directory runs Qdrant's local mode inside this process instead of connecting to QDRANT_URL,
+# meant for the offline benchmarks since local mode searches by exact scan
+QDRANT_LOCAL_PATH = os.getenv("QDRANT_LOCAL_PATH")
+SCROLL_PAGE_SIZE = int(os.getenv("QDRANT_SCROLL_PAGE_SIZE", "1000"))
+# candidates fetched from the short vector index per result of a two stage search
+PREFETCH_MULTIPLIER = int(os.getenv("QDRANT_PREFETCH_MULTIPLIER", "4"))
+# upper bound of the candidates a two stage search fetches from the short vector index, deep pages ask for many
+MAX_PREFETCH_CANDIDATES = int(os.getenv("QDRANT_MAX_PREFETCH_CANDIDATES", "2000"))
+# queries per batch search request, a request with a full and a prefix vector per query is ~20 KB per query and
+# Qdrant rejects requests above 32 MB (gRPC above 4 MB)
+SEARCH_BATCH_SIZE = int(os.getenv("QDRANT_SEARCH_BATCH_SIZE", "128"))
+# how often the vector layout behind a name is re-read, a request rejected for its vectors re-reads it at once
+LAYOUT_TTL_SECONDS = float(os.getenv("QDRANT_LAYOUT_TTL_SECONDS", "30"))
 
+# Qdrant's answers (server and local mode) to vectors that do not match the collection's layout
+layout_error_regex = re.compile(r"vector name|unnamed vector|vector dimension error|dense vector .*not found", re.IGNORECASE)
 
-def create_collection_if_not_exists(collection_name: str, vector_size: int) -> None:
-    collections = client.get_collections()
+T = TypeVar("T")
+
+
+def create_client() -> QdrantClient:
+    if QDRANT_LOCAL_PATH == ":memory:":
+        return QdrantClient(location=":memory:")
+    if QDRANT_LOCAL_PATH:
+        return QdrantClient(path=QDRANT_LOCAL_PATH)
+    return QdrantClient(url=url, timeout=30)
+
+
+client = create_client()
+collection_profile = load_profile()
+search_params = build_search_params(collection_profile)
+
+# bumped on every write made through this module, lets callers cache reads per collection state
+collection_versions: Dict[str, int] = {}
+# collection or alias name -> short vector size, 0 for single vector and payload-only collections
+vector_layouts = TTLCache(256, LAYOUT_TTL_SECONDS)
+
+
+def create_collection_if_not_exists(collection_name: str, vector_size: int | None, profile: CollectionProfile | None = None, short_vector_dim: int = 0) -> None:
+    # a vector_size of None creates a payload-only collection, vector layout and HNSW parameters come from the profile,
+    # a short_vector_dim creates the two stage layout (see commons/qdrant/matryoshka.py)
+    with time_qdrant("sync", "get_collections"):
+        collections = client.get_collections()
     existing_names = [c.name for c in collections.collections]
     if collection_name not in existing_names:
-        client.create_collection(collection_name=collection_name, vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE))
+        vectors_config = build_vectors_config(vector_size, profile or collection_profile, short_vector_dim) if vector_size else {}
+        with time_qdrant("sync", "create_collection"):
+            client.create_collection(collection_name=collection_name, vectors_config=vectors_config)
         logging.info(f"Created collection: {collection_name}")
 
 
+def try_create_collection(collection_name: str) -> bool:
+    # creates a payload-only collection, False when it exists. Qdrant creates a name once even for concurrent requests,
+    # so this also serves as a lock between processes
+    try:
+        with time_qdrant("sync", "create_collection"):
+            client.create_collection(collection_name=collection_name, vectors_config={})
+        return True
+    except (UnexpectedResponse, ValueError) as e:
+        if "already exists" not in str(e):
+            raise
+        return False
+
+
+def delete_collection(collection_name: str) -> None:
+    with time_qdrant("sync", "delete_collection"):
+        client.delete_collection(collection_name)
+    vector_layouts.delete(collection_name)
+
+
+def get_alias_target(alias: str) -> str | None:
+    with time_qdrant("sync", "get_aliases"):
+        aliases = client.get_aliases().aliases
+    return next((a.collection_name for a in aliases if a.alias_name == alias), None)
+
+
+def create_aliased_collection_if_not_exists(alias: str, collection_name: str, vector_size: int, short_vector_dim: int = 0) -> None:
+    # reads and writes go through the alias, collection_name is only used when the alias does not exist yet
+    if get_alias_target(alias) is not None:
+        return
+
+    create_collection_if_not_exists(collection_name, vector_size, short_vector_dim=short_vector_dim)
+    with time_qdrant("sync", "update_aliases"):
+        client.update_collection_aliases(change_aliases_operations=[CreateAliasOperation(create_alias=CreateAlias(collection_name=collection_name, alias_name=alias))])
+    logging.info(f"Created alias {alias} -> {collection_name}")
+
+
+def switch_alias(alias: str, collection_name: str) -> None:
+    # both operations are applied atomically, readers see either the old or the new collection
+    operations = [CreateAliasOperation(create_alias=CreateAlias(collection_name=collection_name, alias_name=alias))]
+    if get_alias_target(alias) is not None:
+        operations.insert(0, DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=alias)))
+
+    with time_qdrant("sync", "update_aliases"):
+        client.update_collection_aliases(change_aliases_operations=operations)
+    bump_collection_version(alias)
+    vector_layouts.delete(alias)
+    logging.info(f"Switched alias {alias} -> {collection_name}")
+
+
+def create_payload_indexes(collection_name: str, indexes: Dict[str, PayloadSchemaType]) -> None:
+    # Qdrant back-fills a new index from the existing points, so this also applies to old collections
+    with time_qdrant("sync", "get_collection"):
+        existing = client.get_collection(collection_name).payload_schema
+    for field_name, schema in indexes.items():
+        if field_name not in existing:
+            with time_qdrant("sync", "create_payload_index"):
+                client.create_payload_index(collection_name=collection_name, field_name=field_name, field_schema=schema, wait=True)
+            logging.info(f"Created {schema.value} payload index on {collection_name}.{field_name}")
+
+
+def get_short_vector_dim(collection_name: str) -> int:
+    short_vector_dim = vector_layouts.get(collection_name)
+    if short_vector_dim is None:
+        with time_qdrant("sync", "get_collection"):
+            collection = client.get_collection(collection_name)
+        short_vector_dim = read_short_vector_dim(collection.config.params.vectors)
+        vector_layouts.set(collection_name, short_vector_dim)
+    return short_vector_dim
+
+
+def is_layout_error(error: Exception) -> bool:
+    return layout_error_regex.search(str(error)) is not None
+
+
+def with_vector_layout(collection_name: str, fn: Callable[[int], T]) -> T:
+    # fn gets the cached short vector size. When a migration moved the alias to a collection with another layout,
+    # Qdrant rejects the vectors, the layout is read again and fn retried once
+    try:
+        return fn(get_short_vector_dim(collection_name))
+    except Exception as e:
+        if not is_layout_error(e):
+            raise
+        logging.info(f"vector layout of {collection_name} changed, reading it again: {e}")
+        vector_layouts.delete(collection_name)
+        return fn(get_short_vector_dim(collection_name))
+
+
+def read_short_vector_dim(vectors_config: VectorParams | Dict[str, VectorParams]) -> int:
+    if isinstance(vectors_config, dict) and SHORT_VECTOR in vectors_config:
+        return vectors_config[SHORT_VECTOR].size
+    return 0
+
+
+def read_vector_size(vectors_config: VectorParams | Dict[str, VectorParams]) -> int:
+    return vectors_config[FULL_VECTOR].size if isinstance(vectors_config, dict) else vectors_config.size
+
+
+def to_point_vector(vector: Any, short_vector_dim: int) -> Any:
+    # points always carry the full embedding, the short vector of a two stage collection is derived here
+    if short_vector_dim and isinstance(vector, list):
+        return build_named_vectors(vector, short_vector_dim)
+    return vector
+
+
 def upsert_points(collection_name: str, points: List[Dict[str, Any]]) -> None:
-    point_structs = [
-        PointStruct(id=point["id"], vector=point["vector"], payload=point["payload"])
-        for point in points
-    ]
-    client.upsert(collection_name=collection_name, points=point_structs)
+    def upsert(short_vector_dim: int) -> None:
+        point_structs = [
+            PointStruct(id=point["id"], vector=to_point_vector(point["vector"], short_vector_dim), payload=point["payload"])
+            for point in points
+        ]
+        with time_qdrant("sync", "upsert"):
+            client.upsert(collection_name=collection_name, points=point_structs)
+
+    with_vector_layout(collection_name, upsert)
+    bump_collection_version(collection_name)
     logging.debug(f"Upserted {len(points)} points to {collection_name}")
 
 
+def build_query(query_vector: List[float], short_vector_dim: int, candidates: int, search_filter: Filter | None) -> Dict[str, Any]:
+    # keyword arguments for query_points, a two stage collection searches the short vector's index for candidates
+    # and ranks them by the full vector, so scores and thresholds stay those of the full embedding
+    if not short_vector_dim:
+        return {"query": query_vector, "query_filter": search_filter, "search_params": search_params}
+
+    # the filter is repeated on the rescoring stage where it only narrows filtered candidates, local mode Qdrant
+    # ignores the prefetch of group queries
+    prefetch = Prefetch(query=truncate_embedding(query_vector, short_vector_dim), using=SHORT_VECTOR, filter=search_filter, params=search_params, limit=min(candidates, MAX_PREFETCH_CANDIDATES))
+    return {"prefetch": prefetch, "query": query_vector, "using": FULL_VECTOR, "query_filter": search_filter}
+
+
+def build_query_request(query_vector: List[float], short_vector_dim: int, limit: int, threshold: float, search_filter: Filter | None) -> QueryRequest:
+    query = build_query(query_vector, short_vector_dim, limit * PREFETCH_MULTIPLIER, search_filter)
+    return QueryRequest(
+        prefetch=query.get("prefetch"),
+        query=query["query"],
+        using=query.get("using"),
+        filter=query.get("query_filter"),
+        params=query.get("search_params"),
+        limit=limit,
+        score_threshold=threshold,
+        with_payload=True,
+    )
+
+
 def search_similar(collection_name: str, query_vector: List[float], limit: int = 20, threshold: float = 0.5) -> List[Dict[str, Any]]:
-    results = client.search(collection_name=collection_name, query_vector=query_vector, limit=limit, score_threshold=threshold)
+    return search_similar_with_filter(collection_name, query_vector, {}, limit, threshold)
+
+
+def search_similar_with_filter(collection_name: str, query_vector: List[float], filter: Dict[str, Any], limit: int = 20, threshold: float = 0.5) -> List[Dict[str, Any]]:
+    search_filter = build_filter(filter) if filter else None
+
+    def search(short_vector_dim: int) -> List[Any]:
+        query = build_query(query_vector, short_vector_dim, limit * PREFETCH_MULTIPLIER, search_filter)
+        with time_qdrant("sync", "search"):
+            return client.query_points(collection_name=collection_name, **query, limit=limit, score_threshold=threshold).points
+
+    results = with_vector_layout(collection_name, search)
     return [
         {
             "id": str(result.id),
@@ -38,54 +231,132 @@ def search_similar(collection_name: str, query_vector: List[float], limit: int =
     ]
 
 
-def search_similar_with_filter(collection_name: str, query_vector: List[float], filter: Dict[str, Any], limit: int = 20, threshold: float = 0.5) -> List[Dict[str, Any]]:
-    if not filter:
-        return search_similar(collection_name, query_vector, limit, threshold)
+def search_similar_batch(collection_name: str, query_vectors: List[List[float]], limit: int = 20, threshold: float = 0.5, filter: Dict[str, Any] | None = None, exclude: Dict[str, Any] | None = None) -> List[List[Dict[str, Any]]]:
+    # one request per SEARCH_BATCH_SIZE query vectors, results are returned in query order
+    if not query_vectors:
+        return []
 
-    search_filter = Filter(must=[
-        FieldCondition(key=key, match=MatchValue(value=value))
-        for key, value in filter.items()
-    ])
+    search_filter = build_filter(filter or {}, exclude) if filter or exclude else None
 
-    results = client.search(collection_name=collection_name, query_vector=query_vector, query_filter=search_filter, limit=limit, score_threshold=threshold)
+    def search_batch(short_vector_dim: int, batch: List[List[float]]) -> List[Any]:
+        requests = [build_query_request(query_vector, short_vector_dim, limit, threshold, search_filter) for query_vector in batch]
+        with time_qdrant("sync", "search_batch"):
+            return client.query_batch_points(collection_name=collection_name, requests=requests)
+
+    batch_results = []
+    for start in range(0, len(query_vectors), SEARCH_BATCH_SIZE):
+        batch = query_vectors[start:start + SEARCH_BATCH_SIZE]
+        batch_results.extend(with_vector_layout(collection_name, lambda short_vector_dim: search_batch(short_vector_dim, batch)))
     return [
-        {
-            "id": str(result.id),
-            "score": float(result.score),
-            "payload": result.payload or {},
-        }
-        for result in results
+        [
+            {
+                "id": str(result.id),
+                "score": float(result.score),
+                "payload": result.payload or {},
+            }
+            for result in response.points
+        ]
+        for response in batch_results
     ]
 
 
-def delete_points_by_filter(collection_name: str, filter_conditions: Dict[str, Any]) -> None:
-    points_to_delete = scroll_points(collection_name, filter_conditions, limit=1000)
+def set_payloads(collection_name: str, payloads: Dict[str, Dict[str, Any]], filter_payloads: List[Tuple[Dict[str, Any], Dict[str, Any]]] | None = None) -> None:
+    # applies per point payloads and (filter, payload) pairs in a single request
+    operations = [
+        SetPayloadOperation(set_payload=SetPayload(payload=payload, filter=build_filter(filter_conditions)))
+        for filter_conditions, payload in filter_payloads or []
+    ]
+    operations += [
+        SetPayloadOperation(set_payload=SetPayload(payload=payload, points=[point_id]))
+        for point_id, payload in payloads.items()
+    ]
+
+    if not operations:
+        return
 
-    if not points_to_delete:
+    with time_qdrant("sync", "set_payload"):
+        client.batch_update_points(collection_name=collection_name, update_operations=operations)
+    bump_collection_version(collection_name)
+    logging.debug(f"Set payload with {len(operations)} operations in {collection_name}")
+
+
+def delete_points(collection_name: str, point_ids: List[str]) -> None:
+    if not point_ids:
         return
 
-    point_ids = [point["id"] for point in points_to_delete]
-    client.delete(collection_name=collection_name, points_selector=point_ids)
+    with time_qdrant("sync", "delete"):
+        client.delete(collection_name=collection_name, points_selector=PointIdsList(points=point_ids))
+    bump_collection_version(collection_name)
     logging.debug(f"Deleted {len(point_ids)} points from {collection_name}")
 
 
-def scroll_points(collection_name: str, filter_conditions: Dict[str, Any], limit: int = 100, with_vectors: bool = False) -> List[Dict[str, Any]]:
-    search_filter = Filter(must=[
-        FieldCondition(key=key, match=MatchValue(value=value))
-        for key, value in filter_conditions.items()
-    ])
+def delete_points_by_filter(collection_name: str, filter_conditions: Dict[str, Any]) -> None:
+    # one request regardless of how many points match
+    with time_qdrant("sync", "delete"):
+        client.delete(collection_name=collection_name, points_selector=FilterSelector(filter=build_filter(filter_conditions)))
+    bump_collection_version(collection_name)
+    logging.debug(f"Deleted points matching {filter_conditions} from {collection_name}")
 
-    results, _ = client.scroll(collection_name=collection_name, scroll_filter=search_filter, limit=limit, with_payload=True, with_vectors=with_vectors)
 
-    return [
-        {"id": str(result.id), "payload": result.payload or {}, "vector": result.vector if with_vectors else None}
-        for result in results
-    ]
+def scroll_points(collection_name: str, filter_conditions: Dict[str, Any], limit: int | None = None, with_vectors: bool = False, with_payload: bool | List[str] = True, page_size: int = SCROLL_PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+    # pages through matching points (up to limit), with_payload may list the payload keys to return
+    search_filter = build_filter(filter_conditions)
+    offset = None
+    remaining = limit
+
+    while remaining is None or remaining > 0:
+        page_limit = page_size if remaining is None else min(page_size, remaining)
+        with time_qdrant("sync", "scroll"):
+            results, offset = client.scroll(collection_name=collection_name, scroll_filter=search_filter, limit=page_limit, offset=offset, with_payload=with_payload, with_vectors=with_vectors)
+
+        for result in results:
+            yield {"id": str(result.id), "payload": result.payload or {}, "vector": full_vector(result.vector) if with_vectors else None}
+
+        if remaining is not None:
+            remaining -= len(results)
+        if offset is None:
+            return
+
+
+def retrieve_points(collection_name: str, point_ids: List[int | str], with_vectors: bool = False) -> List[Dict[str, Any]]:
+    with time_qdrant("sync", "retrieve"):
+        results = client.retrieve(collection_name=collection_name, ids=point_ids, with_payload=True, with_vectors=with_vectors)
+    return [{"id": str(result.id), "payload": result.payload or {}, "vector": full_vector(result.vector) if with_vectors else None} for result in results]
+
+
+def count_points(collection_name: str) -> int:
+    with time_qdrant("sync", "count"):
+        return client.count(collection_name=collection_name, exact=True).count
+
+
+def bump_collection_version(collection_name: str) -> None:
+    collection_versions[collection_name] = collection_versions.get(collection_name, 0) + 1
+
+
+def get_collection_version(collection_name: str) -> int:
+    return collection_versions.get(collection_name, 0)
+
+
+def build_filter(filter_conditions: Dict[str, Any], exclude_conditions: Dict[str, Any] | None = None) -> Filter:
+    # list values match any of their items, dict values are ranges ({"gte": ..., "lte": ...}, strings
+    # compare as datetimes), points matching any exclude condition are left out
+    return Filter(
+        must=[build_condition(key, value) for key, value in filter_conditions.items()],
+        must_not=[build_condition(key, value) for key, value in (exclude_conditions or {}).items()] or None,
+    )
+
+
+def build_condition(key: str, value: Any) -> FieldCondition:
+    if isinstance(value, dict):
+        is_datetime = any(isinstance(bound, str) for bound in value.values())
+        return FieldCondition(key=key, range=DatetimeRange(**value) if is_datetime else Range(**value))
+    return FieldCondition(key=key, match=MatchAny(any=value) if isinstance(value, list) else MatchValue(value=value))
 
 
 def health_check() -> bool:
     try:
-        client.get_collections()
+        with time_qdrant("sync", "health"):
+            client.get_collections()
         return True
     except Exception as e:
         logging.error(f"qdrant health check failed: {e}")
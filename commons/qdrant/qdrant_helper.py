@@ -1,31 +1,131 @@
 import os
+import io
 import logging
-from typing import List
+import threading
+import numpy as np
+from typing import List, Tuple, Dict, Any
+from PIL import Image
 from fastembed import TextEmbedding, ImageEmbedding
-from commons.qdrant.qdrant_client import create_collection_if_not_exists
-
-NOTE_COLLECTION = "notes_v1"
-IMAGE_COLLECTION = "images_v1"
+from qdrant_client.models import PayloadSchemaType
+from commons.qdrant.qdrant_client import create_aliased_collection_if_not_exists, create_collection_if_not_exists, create_payload_indexes
+from commons.cache.embedding_cache import embed_with_cache
+from commons.batching.micro_batcher import MicroBatcher
+from commons.metrics.metrics import batch_size, time_stage, timed_stage
+from commons.embedding_worker.worker_client import embed_in_worker
+
+# aliases used for all reads and writes, they point at the versioned collection (see commons/qdrant/migrate_collection.py)
+NOTE_COLLECTION = "notes"
+IMAGE_COLLECTION = "images"
+INITIAL_NOTE_COLLECTION = "notes_v1"
+INITIAL_IMAGE_COLLECTION = "images_v1"
+RELATED_NOTES_COLLECTION = "related_notes_v1"  # payload only, one point per note
+RELATED_NOTES_REBUILD_LOCK = "related_notes_v1_rebuild_lock"  # exists while one process rebuilds the graph
+
+# every field used in filters, updated_at is an RFC 3339 string
+NOTE_PAYLOAD_INDEXES = {"note_id": PayloadSchemaType.INTEGER, "tags": PayloadSchemaType.KEYWORD, "updated_at": PayloadSchemaType.DATETIME}
+IMAGE_PAYLOAD_INDEXES = {"filename": PayloadSchemaType.KEYWORD}
+RELATED_NOTES_PAYLOAD_INDEXES = {"related_note_ids": PayloadSchemaType.INTEGER}
 TEXT_EMBED_MODEL = "nomic-ai/nomic-embed-text-v1.5"
 IMAGE_EMBED_MODEL = "Qdrant/clip-ViT-B-32-vision"
 IMAGE_QUERY_MODEL = "Qdrant/clip-ViT-B-32-text"
-
-
-create_collection_if_not_exists(NOTE_COLLECTION, 768)
-create_collection_if_not_exists(IMAGE_COLLECTION, 512)
-
-
-text_model = TextEmbedding(model_name=TEXT_EMBED_MODEL)
-image_model = ImageEmbedding(model_name=IMAGE_EMBED_MODEL)
-image_query_model = TextEmbedding(model_name=IMAGE_QUERY_MODEL)
-
-
+TEXT_EMBED_DIM = 768
+IMAGE_EMBED_DIM = 512  # shared by the CLIP vision and text models
+# nomic-embed-text-v1.5 is trained for Matryoshka prefixes of 64 to 768 dimensions, new note collections index a
+# prefix of this size and rescore with the full vector, 0 creates them with the full vector only
+NOTE_SHORT_VECTOR_DIM = int(os.getenv("NOTE_SHORT_VECTOR_DIM", "256"))
+MODEL_DIMENSIONS = {TEXT_EMBED_MODEL: TEXT_EMBED_DIM, IMAGE_EMBED_MODEL: IMAGE_EMBED_DIM, IMAGE_QUERY_MODEL: IMAGE_EMBED_DIM}
+MODEL_STAGES = {TEXT_EMBED_MODEL: "text_model", IMAGE_EMBED_MODEL: "image_model", IMAGE_QUERY_MODEL: "image_query_model"}  # metric labels
+IMAGE_INPUT_SIZE = 224  # CLIP resizes the shortest side to this before center cropping
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32"))
+QUERY_BATCH_MAX_WAIT_MS = float(os.getenv("QUERY_BATCH_MAX_WAIT_MS", "5"))
+# queries waiting for a batch beyond this are rejected with 429, they wait on the event loop and not in the search lane
+QUERY_BATCH_MAX_PENDING = int(os.getenv("QUERY_BATCH_MAX_PENDING", "256"))
+TEXT_BATCH_SIZE = 256
+
+# "local" runs the models in this process, "worker" sends inference to the embedding worker pool
+EMBEDDING_BACKENDS = ("local", "worker")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "local")
+
+if EMBEDDING_BACKEND not in EMBEDDING_BACKENDS:
+    raise ValueError(f"Invalid EMBEDDING_BACKEND: {EMBEDDING_BACKEND} (expected one of {', '.join(EMBEDDING_BACKENDS)})")
+
+if not 0 <= NOTE_SHORT_VECTOR_DIM < TEXT_EMBED_DIM:
+    raise ValueError(f"Invalid NOTE_SHORT_VECTOR_DIM: {NOTE_SHORT_VECTOR_DIM} (expected 0 to {TEXT_EMBED_DIM - 1})")
+
+
+# models are loaded on first use (or by warmup_models) so importing this module stays cheap
+models: Dict[str, TextEmbedding | ImageEmbedding] = {}
+models_lock = threading.Lock()
+collections_ready = False
+
+
+def ensure_collections() -> None:
+    global collections_ready
+    if collections_ready:
+        return
+
+    create_aliased_collection_if_not_exists(NOTE_COLLECTION, INITIAL_NOTE_COLLECTION, TEXT_EMBED_DIM, NOTE_SHORT_VECTOR_DIM)
+    create_aliased_collection_if_not_exists(IMAGE_COLLECTION, INITIAL_IMAGE_COLLECTION, IMAGE_EMBED_DIM)
+    create_collection_if_not_exists(RELATED_NOTES_COLLECTION, None)
+    create_payload_indexes(NOTE_COLLECTION, NOTE_PAYLOAD_INDEXES)
+    create_payload_indexes(IMAGE_COLLECTION, IMAGE_PAYLOAD_INDEXES)
+    create_payload_indexes(RELATED_NOTES_COLLECTION, RELATED_NOTES_PAYLOAD_INDEXES)
+    collections_ready = True
+
+
+def get_model(model_name: str, threads: int | None = None) -> TextEmbedding | ImageEmbedding:
+    # threads caps ONNX intra-op threads, it only applies when the model is first loaded
+    model = models.get(model_name)
+    if model is not None:
+        return model
+
+    with models_lock:
+        if model_name not in models:
+            model_class = ImageEmbedding if model_name == IMAGE_EMBED_MODEL else TextEmbedding
+            models[model_name] = model_class(model_name=model_name, threads=threads)
+            logging.info(f"Loaded model: {model_name}")
+        return models[model_name]
+
+
+def run_model(model_name: str, inputs: List[Any]) -> np.ndarray:
+    # images go through CLIP as one batch, texts in the model's default batch size
+    batch_size = len(inputs) if model_name == IMAGE_EMBED_MODEL else TEXT_BATCH_SIZE
+    return np.array(list(get_model(model_name).embed(inputs, batch_size=batch_size)), dtype=np.float32)
+
+
+def run_model_in_backend(model_name: str, inputs: List[Any], dim: int) -> List[List[float]]:
+    stage = MODEL_STAGES[model_name]
+    batch_size.observe(len(inputs), (stage,))
+    with time_stage(stage):
+        if EMBEDDING_BACKEND == "worker":
+            return embed_in_worker(model_name, inputs, dim)
+        return run_model(model_name, inputs).tolist()
+
+
+def get_warmup_inputs() -> Dict[str, List[Any]]:
+    return {
+        TEXT_EMBED_MODEL: ["warmup"],
+        IMAGE_EMBED_MODEL: [Image.new("RGB", (IMAGE_INPUT_SIZE, IMAGE_INPUT_SIZE))],
+        IMAGE_QUERY_MODEL: ["warmup"],
+    }
+
+
+def warmup_models() -> None:
+    # loads every model and runs one dummy inference so the first request does not pay for graph initialization
+    for model_name, inputs in get_warmup_inputs().items():
+        run_model_in_backend(model_name, inputs, MODEL_DIMENSIONS[model_name])
+
+
+@timed_stage("embed_texts")
 def embed_texts(texts: List[str]) -> List[List[float]]:
     if not texts:
         return []
 
-    embeddings = list(text_model.embed(texts))
-    return [embedding.tolist() for embedding in embeddings]
+    return embed_with_cache(TEXT_EMBED_MODEL, [text.encode("utf-8") for text in texts], texts, embed_texts_uncached)
+
+
+def embed_texts_uncached(texts: List[str]) -> List[List[float]]:
+    return run_model_in_backend(TEXT_EMBED_MODEL, texts, TEXT_EMBED_DIM)
 
 
 def embed_text(text: str) -> List[float]:
@@ -35,14 +135,65 @@ def embed_text(text: str) -> List[float]:
     return embed_texts([text])[0]
 
 
-def embed_image(image_path: str) -> List[float]:
+@timed_stage("embed_images")
+def embed_images(images: List[Image.Image], contents: List[bytes]) -> List[List[float]]:
+    # contents are the original file bytes and only serve as cache keys
+    if not images:
+        return []
+
+    return embed_with_cache(IMAGE_EMBED_MODEL, contents, images, embed_images_uncached)
+
+
+def embed_images_uncached(images: List[Image.Image]) -> List[List[float]]:
+    return run_model_in_backend(IMAGE_EMBED_MODEL, images, IMAGE_EMBED_DIM)
+
+
+@timed_stage("load_image")
+def load_image(image_path: str) -> Tuple[Image.Image, bytes]:
+    # decodes and shrinks an image to the model's input size, JPEGs are decoded at reduced scale (draft mode)
     if not os.path.exists(image_path):
         raise FileNotFoundError(f"Image not found: {image_path}")
 
-    embeddings = list(image_model.embed([image_path]))
-    return embeddings[0].tolist()
+    with open(image_path, "rb") as f:
+        content = f.read()
+
+    image = Image.open(io.BytesIO(content))
+    image.draft("RGB", (IMAGE_INPUT_SIZE, IMAGE_INPUT_SIZE))
+    image = image.convert("RGB")
+
+    scale = IMAGE_INPUT_SIZE / min(image.size)
+    if scale < 1:
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.Resampling.BICUBIC)
+
+    return image, content
+
+
+async def embed_query_async(query: str) -> List[float]:
+    # concurrent search queries share one model call, the request waits for its batch without holding a thread
+    if not query.strip():
+        raise ValueError("Query cannot be empty")
+
+    with time_stage("embed_query"):
+        return await text_query_batcher.submit_async(query)
+
+
+async def embed_query_for_images_async(query: str) -> List[float]:
+    with time_stage("embed_query_for_images"):
+        return await image_query_batcher.submit_async(query)
+
+
+@timed_stage("embed_image_queries")
+def embed_image_queries(queries: List[str]) -> List[List[float]]:
+    return embed_with_cache(IMAGE_QUERY_MODEL, [query.encode("utf-8") for query in queries], queries, embed_image_queries_uncached)
+
+
+def embed_image_queries_uncached(queries: List[str]) -> List[List[float]]:
+    return run_model_in_backend(IMAGE_QUERY_MODEL, queries, IMAGE_EMBED_DIM)
+
+
+text_query_batcher = MicroBatcher("text-query", embed_texts, QUERY_BATCH_MAX_SIZE, QUERY_BATCH_MAX_WAIT_MS, QUERY_BATCH_MAX_PENDING)
+image_query_batcher = MicroBatcher("image-query", embed_image_queries, QUERY_BATCH_MAX_SIZE, QUERY_BATCH_MAX_WAIT_MS, QUERY_BATCH_MAX_PENDING)
 
 
-def embed_query_for_images(query: str) -> List[float]:
-    embeddings = list(image_query_model.embed([query]))
-    return embeddings[0].tolist()
\ No newline at end of file
+def get_query_batching_stats() -> Dict[str, Dict[str, Any]]:
+    return {"text": text_query_batcher.stats(), "image": image_query_batcher.stats()}
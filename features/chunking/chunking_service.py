@@ -1,11 +1,12 @@
+import os
 import logging
 import re
 import numpy as np
-import spacy
-from typing import List
+from typing import Iterable, Iterator, List, Tuple
 from strip_markdown import strip_markdown
-from sklearn.metrics.pairwise import cosine_similarity
+from commons.metrics.metrics import processed_items, time_stage, timed_stage
 from commons.qdrant.qdrant_helper import embed_texts
+from features.chunking.segmentation_service import iter_sentences, split_many_into_sentences
 
 
 CHUNK_BREAK_THRESHOLD = 0.5
@@ -13,8 +14,11 @@ MIN_SENTENCES_PER_CHUNK = 2
 MAX_SENTENCES_PER_CHUNK = 10
 MIN_CHUNK_LENGTH = 20
 
+# notes longer than this are chunked as a stream of segments cut on Markdown block boundaries, so memory stays
+# bounded by the segment size and the input never reaches spaCy's max_length
+STREAMING_CHUNK_THRESHOLD = int(os.getenv("STREAMING_CHUNK_THRESHOLD", "200000"))
+STREAM_SEGMENT_CHARS = int(os.getenv("STREAM_SEGMENT_CHARS", "20000"))
 
-nlp = spacy.load("en_core_web_sm")
 
 code_fence_regex = re.compile(r'(?s)```[^`]*```')
 markdown_url_regex = re.compile(r'!?\[([^\]]*)\]\([^)]+\)')
@@ -22,85 +26,248 @@ url_regex = re.compile(r'https?://[^\s]+')
 
 
 def chunk_note(content: str) -> List[str]:
-    if not content.strip():
+    try:
+        return chunk_notes([content])[0]
+    except Exception as e:
+        logging.error(f"Chunking failed: {e}")
         return []
 
+
+@timed_stage("chunk_notes")
+def chunk_notes(contents: List[str]) -> List[List[str]]:
+    return [chunks for chunks, _ in split_notes(contents, with_vectors=False)]
+
+
+@timed_stage("chunk_notes")
+def chunk_notes_with_vectors(contents: List[str]) -> List[Tuple[List[str], List[List[float]]]]:
+    return split_notes(contents, with_vectors=True)
+
+
+def split_notes(contents: List[str], with_vectors: bool) -> List[Tuple[List[str], List[List[float]]]]:
+    # notes up to STREAMING_CHUNK_THRESHOLD share one spaCy pass and model call, longer ones are streamed one by one
+    indices = [i for i, content in enumerate(contents) if len(content) <= STREAMING_CHUNK_THRESHOLD]
+    batched = split_many_by_semantic_similarity([clean_note_content(contents[i]) for i in indices], with_vectors)
+
+    results: List[Tuple[List[str], List[List[float]]]] = [([], []) for _ in contents]
+    for i, result in zip(indices, batched):
+        results[i] = result
+    for i, content in enumerate(contents):
+        if len(content) > STREAMING_CHUNK_THRESHOLD:
+            chunks = list(stream_note_chunks(content, with_vectors))
+            results[i] = ([chunk for chunk, _ in chunks], [vector for _, vector in chunks] if with_vectors else [])
+    return results
+
+
+@timed_stage("clean_note_content")
+def clean_note_content(content: str) -> str:
+    if not content.strip():
+        return ""
+
     content = code_fence_regex.sub('', content)
     content = markdown_url_regex.sub(r'\1', content) # preserve alt text
     content = url_regex.sub('', content)
     content = strip_markdown(content)
-    content = content.strip()
+    return content.strip()
 
-    if not content:
-        return []
 
-    try:
-        chunks = split_by_semantic_similarity(content)
-        return chunks if chunks else []
-    except Exception as e:
-        logging.error(f"Chunking failed: {e}")
-        return []
+@timed_stage("split_by_semantic_similarity")
+def split_many_by_semantic_similarity(contents: List[str], with_vectors: bool) -> List[Tuple[List[str], List[List[float]]]]:
+    # segments all notes in one spaCy pass and embeds all of their sentences in one model call
+    indices = [i for i, content in enumerate(contents) if content]
+    with time_stage("sentence_segmentation"):
+        sentence_lists = split_many_into_sentences([contents[i] for i in indices])
 
+    notes = []
+    sentences_to_embed = []
+    for i, sentences in zip(indices, sentence_lists):
+        if len(sentences) <= 1:
+            sentences = [contents[i]]
 
-def split_by_semantic_similarity(content: str) -> List[str]:
-    sentences = split_into_sentences(content)
-    if len(sentences) <= 1:
-        return [content]
+        needs_embedding = len(sentences) > 1 or with_vectors
+        notes.append((i, sentences, len(sentences_to_embed) if needs_embedding else None))
+        if needs_embedding:
+            sentences_to_embed.extend(sentences)
 
-    logging.debug(f"Starting semantic splitting with {len(sentences)} sentences")
+    logging.debug(f"Starting semantic splitting of {len(notes)} notes with {len(sentences_to_embed)} sentences")
 
-    chunks = []
-    current_chunk = []
+    with time_stage("sentence_embedding"):
+        embeddings = np.array(embed_texts(sentences_to_embed), dtype=np.float64)
 
-    for i in range(len(sentences)):
-        current_chunk.append(sentences[i])
+    results: List[Tuple[List[str], List[List[float]]]] = [([], []) for _ in contents]
+    with time_stage("sentence_grouping"):
+        for i, sentences, offset in notes:
+            if len(sentences) > 1:
+                note_embeddings = embeddings[offset:offset + len(sentences)]
+                groups = group_sentences(sentences, compute_adjacent_similarities(note_embeddings))
+            else:
+                note_embeddings = embeddings[offset:offset + 1] if offset is not None else None
+                groups = [[0]]
+
+            chunks = join_sentence_groups(sentences, groups)
+            vectors = [pool_sentence_embeddings(note_embeddings[group]) for group in groups] if with_vectors else []
+            results[i] = (chunks, vectors)
+
+            logging.debug(f"Completed semantic chunking: {len(sentences)} sentences -> {len(chunks)} chunks")
+
+    processed_items.inc(len(contents), ("notes",))
+    processed_items.inc(sum(len(sentences) for _, sentences, _ in notes), ("sentences",))
+    processed_items.inc(sum(len(chunks) for chunks, _ in results), ("chunks",))
+    return results
+
+
+def stream_note_chunks(content: str, with_vectors: bool) -> Iterator[Tuple[str, List[float] | None]]:
+    # segments -> cleaning -> sentences -> sentence vectors -> groups, each stage pulls one segment at a time, so a
+    # chunk is yielded as soon as the sentence after it is known, whatever the size of the note
+    segments = (clean_note_content(segment) for segment in iter_note_segments(content))
+    for group in iter_sentence_groups(iter_embedded_sentences(segments)):
+        processed_items.inc(1, ("chunks",))
+        chunk = ' '.join(sentence for sentence, _ in group)
+        yield chunk, pool_sentence_embeddings(np.array([embedding for _, embedding in group])) if with_vectors else None
+    processed_items.inc(1, ("notes",))
+
+
+def iter_note_segments(content: str, max_chars: int = STREAM_SEGMENT_CHARS) -> Iterator[str]:
+    # cuts at the first blank line after max_chars, at the line break before twice that (logs and transcripts have
+    # no blank lines) and inside lines longer than max_chars. A code fence cut in two is closed and reopened so
+    # clean_note_content still removes both halves
+    lines: List[str] = []
+    size = 0
+    in_fence = False
+
+    for line in iter_lines(content):
+        for piece in split_long_line(line, max_chars):
+            if lines and size + len(piece) > 2 * max_chars:
+                yield "".join(lines) + ("\n```\n" if in_fence else "")
+                lines = ["```\n"] if in_fence else []
+                size = 0
+
+            lines.append(piece)
+            size += len(piece)
+            if piece.lstrip().startswith("```"):
+                in_fence = not in_fence
 
-        should_break_chunk = False
+            if size >= max_chars and not in_fence and not piece.strip():
+                yield "".join(lines)
+                lines = []
+                size = 0
 
-        if len(current_chunk) >= MAX_SENTENCES_PER_CHUNK:
-            should_break_chunk = True
+    if lines:
+        yield "".join(lines)
 
-        if i < len(sentences) - 1:
-            embeddings = embed_texts([sentences[i], sentences[i + 1]])
-            similarity = cosine_similarity(np.array([embeddings[0]]), np.array([embeddings[1]]))[0][0]
-            if similarity < CHUNK_BREAK_THRESHOLD:
-                should_break_chunk = True
 
-        if i == len(sentences) - 1:
-            should_break_chunk = True
+def iter_lines(content: str) -> Iterator[str]:
+    # like content.splitlines(keepends=True) without building the list
+    start = 0
+    while start < len(content):
+        end = content.find("\n", start)
+        end = len(content) if end == -1 else end + 1
+        yield content[start:end]
+        start = end
+
+
+def split_long_line(line: str, max_chars: int) -> Iterator[str]:
+    while len(line) > max_chars:
+        cut = line.rfind(" ", 0, max_chars) + 1 or max_chars
+        yield line[:cut]
+        line = line[cut:]
+    yield line
+
+
+def iter_embedded_sentences(segments: Iterable[str]) -> Iterator[Tuple[str, np.ndarray]]:
+    for sentences in iter_sentences(segment for segment in segments if segment):
+        processed_items.inc(len(sentences), ("sentences",))
+        with time_stage("sentence_embedding"):
+            embeddings = np.array(embed_texts(sentences), dtype=np.float64)
+        yield from zip(sentences, embeddings)
+
+
+def iter_sentence_groups(sentences: Iterable[Tuple[str, np.ndarray]]) -> Iterator[List[Tuple[str, np.ndarray]]]:
+    # group_sentences over a stream of (sentence, vector): a sentence is placed once the next one is known, and the
+    # last finished group is held back because a short trailing group is merged into it
+    items = iter(sentences)
+    previous = next(items, None)
+    current: List[Tuple[str, np.ndarray]] = []
+    held = None
+
+    while previous is not None:
+        item = next(items, None)
+        current.append(previous)
+
+        is_last = item is None
+        should_break_chunk = len(current) >= MAX_SENTENCES_PER_CHUNK or is_last or cosine_similarity(previous[1], item[1]) < CHUNK_BREAK_THRESHOLD
+        previous = item
 
         if not should_break_chunk:
             continue
 
-        if len(current_chunk) >= MIN_SENTENCES_PER_CHUNK:
-            chunk = ' '.join(current_chunk).strip()
-            if len(chunk) >= MIN_CHUNK_LENGTH:
-                chunks.append(chunk)
-            current_chunk = []
+        chunk_length = sum(len(sentence) for sentence, _ in current) + len(current) - 1
+
+        if len(current) >= MIN_SENTENCES_PER_CHUNK:
+            if chunk_length >= MIN_CHUNK_LENGTH:
+                if held is not None:
+                    yield held
+                held = current
+            current = []
+        elif is_last and chunk_length >= MIN_CHUNK_LENGTH:
+            held = held + current if held is not None else current
+
+    if held is not None:
+        yield held
+
+
+def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    norm = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(a @ b / norm) if norm else 0.0
+
+
+def join_sentence_groups(sentences: List[str], groups: List[List[int]]) -> List[str]:
+    return [' '.join(sentences[i] for i in group) for group in groups]
+
+
+def pool_sentence_embeddings(embeddings: np.ndarray) -> List[float]:
+    # mean of the normalized sentence vectors, re-normalized to unit length
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    pooled = (embeddings / np.where(norms == 0, 1, norms)).mean(axis=0)
+    norm = np.linalg.norm(pooled)
+    return (pooled / norm if norm else pooled).tolist()
+
+
+def compute_adjacent_similarities(embeddings: np.ndarray) -> np.ndarray:
+    # cosine similarity of each sentence with the next one, zero vectors score 0
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    normalized = embeddings / np.where(norms == 0, 1, norms)
+    return np.einsum('ij,ij->i', normalized[:-1], normalized[1:])
+
+
+def group_sentences(sentences: List[str], similarities: np.ndarray) -> List[List[int]]:
+    groups = []
+    current_group = []
+    last_index = len(sentences) - 1
+
+    for i in range(len(sentences)):
+        current_group.append(i)
+
+        is_last = i == last_index
+        should_break_chunk = len(current_group) >= MAX_SENTENCES_PER_CHUNK or is_last or similarities[i] < CHUNK_BREAK_THRESHOLD
+
+        if not should_break_chunk:
             continue
 
-        if len(current_chunk) < MIN_SENTENCES_PER_CHUNK and i == len(sentences) - 1:
-            chunk = ' '.join(current_chunk).strip()
-            if len(chunk) >= MIN_CHUNK_LENGTH:
-                if chunks:
-                    chunks[-1] += ' ' + chunk
-                else:
-                    chunks.append(chunk)
-            current_chunk = []
-
-    if current_chunk:
-        chunk = ' '.join(current_chunk).strip()
-        if len(chunk) >= MIN_CHUNK_LENGTH:
-            if chunks and len(current_chunk) < MIN_SENTENCES_PER_CHUNK:
-                chunks[-1] += ' ' + chunk
-            else:
-                chunks.append(chunk)
+        chunk_length = sum(len(sentences[j]) for j in current_group) + len(current_group) - 1
 
-    logging.debug(f"Completed semantic chunking: {len(sentences)} sentences -> {len(chunks)} chunks")
-    return chunks
+        if len(current_group) >= MIN_SENTENCES_PER_CHUNK:
+            if chunk_length >= MIN_CHUNK_LENGTH:
+                groups.append(current_group)
+            current_group = []
+            continue
 
+        if is_last:
+            # a short trailing group is merged into the previous chunk
+            if chunk_length >= MIN_CHUNK_LENGTH:
+                if groups:
+                    groups[-1].extend(current_group)
+                else:
+                    groups.append(current_group)
+            current_group = []
 
-def split_into_sentences(content: str) -> List[str]:
-    doc = nlp(content)
-    sentences = [sent.text.strip() for sent in doc.sents if sent.text.strip()]
-    return sentences
\ No newline at end of file
+    return groups
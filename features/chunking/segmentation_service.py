@@ -0,0 +1,76 @@
+import os
+import logging
+import threading
+import spacy
+from typing import Iterable, Iterator, List
+from spacy.language import Language
+from spacy.tokens import Doc
+
+
+SPACY_MODEL = "en_core_web_sm"
+
+# "parser" uses the dependency parse (slowest, previous behavior), "senter" the model's
+# statistical sentence recognizer, "sentencizer" punctuation rules only
+SENTENCE_SEGMENTERS = ("parser", "senter", "sentencizer")
+SENTENCE_SEGMENTER = os.getenv("SENTENCE_SEGMENTER", "senter")
+SEGMENTATION_PROCESSES = int(os.getenv("SEGMENTATION_PROCESSES", "1"))
+SEGMENTATION_BATCH_SIZE = int(os.getenv("SEGMENTATION_BATCH_SIZE", "64"))
+
+if SENTENCE_SEGMENTER not in SENTENCE_SEGMENTERS:
+    raise ValueError(f"Invalid SENTENCE_SEGMENTER: {SENTENCE_SEGMENTER} (expected one of {', '.join(SENTENCE_SEGMENTERS)})")
+
+
+def load_pipeline(segmenter: str) -> Language:
+    if segmenter == "sentencizer":
+        pipeline = spacy.blank("en")
+        pipeline.add_pipe("sentencizer")
+        return pipeline
+
+    if segmenter == "senter":
+        # senter has its own embedding layer, so nothing else needs to be loaded
+        pipeline = spacy.load(SPACY_MODEL, exclude=["tok2vec", "tagger", "parser", "attribute_ruler", "lemmatizer", "ner"])
+        pipeline.enable_pipe("senter")
+        return pipeline
+
+    return spacy.load(SPACY_MODEL, exclude=["tagger", "attribute_ruler", "lemmatizer", "ner"])
+
+
+nlp: Language | None = None
+nlp_lock = threading.Lock()
+
+
+def get_pipeline() -> Language:
+    global nlp
+    if nlp is None:
+        with nlp_lock:
+            if nlp is None:
+                nlp = load_pipeline(SENTENCE_SEGMENTER)
+                logging.info(f"Loaded sentence segmenter: {SENTENCE_SEGMENTER} ({', '.join(nlp.pipe_names)})")
+    return nlp
+
+
+def warmup_segmentation() -> None:
+    split_into_sentences("Warm up the pipeline. It runs once.")
+
+
+def split_into_sentences(content: str) -> List[str]:
+    return sentences_from_doc(get_pipeline()(content))
+
+
+def split_many_into_sentences(contents: Iterable[str], n_process: int = SEGMENTATION_PROCESSES, batch_size: int = SEGMENTATION_BATCH_SIZE) -> List[List[str]]:
+    contents = list(contents)
+    if len(contents) <= 1:
+        n_process = 1
+
+    docs = get_pipeline().pipe(contents, n_process=n_process, batch_size=batch_size)
+    return [sentences_from_doc(doc) for doc in docs]
+
+
+def iter_sentences(contents: Iterable[str], batch_size: int = 1) -> Iterator[List[str]]:
+    # lazy counterpart of split_many_into_sentences, contents are read from the iterable as spaCy gets to them
+    for doc in get_pipeline().pipe(contents, batch_size=batch_size):
+        yield sentences_from_doc(doc)
+
+
+def sentences_from_doc(doc: Doc) -> List[str]:
+    return [sent.text.strip() for sent in doc.sents if sent.text.strip()]
@@ -1,12 +1,35 @@
+import os
+import re
+import json
+import codecs
+import asyncio
 import logging
 import time
-from typing import List
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from features.embedding.embedding_service import (process_note, process_image, delete_note_embeddings, delete_image_embeddings)
+import grpc
+import httpx
+from typing import List, Dict, Any, AsyncIterator, Iterator, Tuple
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+from starlette.requests import ClientDisconnect
+from features.embedding.embedding_service import (NoteInput, process_note, process_notes, process_image, process_images, delete_note_embeddings, delete_image_embeddings)
+from commons.cache.embedding_cache import get_cache_stats
+from commons.executors.lane_executor import LaneBusyError, run_ingest
 router = APIRouter()
 
 
+BULK_NOTE_BATCH_SIZE = int(os.getenv("BULK_NOTE_BATCH_SIZE", "32"))
+BULK_BATCH_MAX_CHARS = int(os.getenv("BULK_BATCH_MAX_CHARS", "2000000"))
+BULK_MAX_OBJECT_CHARS = int(os.getenv("BULK_MAX_OBJECT_CHARS", "50000000"))
+BULK_BACKOFF_SECONDS = 0.1
+# values at least this long are decoded on a thread instead of the event loop
+BULK_THREAD_DECODE_CHARS = 1000000
+
+# errors of Qdrant or the embedding workers fail every note alike, retrying smaller batches would only repeat them
+INFRASTRUCTURE_ERRORS = (ResponseHandlingException, UnexpectedResponse, httpx.TransportError, grpc.RpcError, OSError, EOFError)
+
+
 class EmbedNoteRequest(BaseModel):
     title: str
     content: str
@@ -14,6 +37,19 @@ class EmbedNoteRequest(BaseModel):
     updated_at: str
 
 
+class BulkEmbedNoteRequest(EmbedNoteRequest):
+    note_id: int
+
+
+class RequestStreamingResponse(StreamingResponse):
+    # the response body reads the request body itself, so receive() must not be
+    # shared with StreamingResponse's disconnect listener, which would drop body chunks
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
 class EmbedImageRequest(BaseModel):
     filename: str
     image_path: str
@@ -33,20 +69,29 @@ class SearchRequest(BaseModel):
 async def embed_note_route(note_id: int, request: EmbedNoteRequest):
     try:
         start = time.time()
-        process_note(note_id=note_id, title=request.title, content=request.content, tags=request.tags, updated_at=request.updated_at)
+        await run_ingest(process_note, note_id=note_id, title=request.title, content=request.content, tags=request.tags, updated_at=request.updated_at)
         elapsed = time.time() - start
         logging.info(f"embedded note: {request.title} ({elapsed:.2f}s)")
         return {"success": True}
+    except LaneBusyError:
+        raise
     except Exception as e:
         logging.error(f"failed to embed note {note_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/embed/notes")
+async def embed_notes_bulk_route(request: Request):
+    # body is NDJSON or a JSON array of notes, results are streamed back as NDJSON
+    return RequestStreamingResponse(stream_bulk_embed_results(request.stream()), media_type="application/x-ndjson")
+
+
 @router.post("/embed/images/{filename}")
 async def embed_image_route(filename: str, request: EmbedImageRequest):
     try:
         start = time.time()
-        process_image(
+        await run_ingest(
+            process_image,
             filename=filename,
             image_path=request.image_path,
             width=request.width,
@@ -58,15 +103,42 @@ async def embed_image_route(filename: str, request: EmbedImageRequest):
         elapsed = time.time() - start
         logging.info(f"embedded image: {filename} ({elapsed:.2f}s)")
         return {"success": True}
+    except LaneBusyError:
+        raise
     except Exception as e:
         logging.error(f"failed to embed image {filename}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/embed/images")
+async def embed_images_bulk_route(request: List[EmbedImageRequest]):
+    try:
+        images = [
+            {
+                "filename": image.filename,
+                "image_path": image.image_path,
+                "width": image.width,
+                "height": image.height,
+                "aspect_ratio": image.aspect_ratio,
+                "file_size": image.file_size,
+                "format": image.format,
+            }
+            for image in request
+        ]
+        result = await run_ingest(process_images, images)
+        logging.info(f"embedded {result['processed']} images, {len(result['failed'])} failed ({result['elapsed']:.2f}s, {result['images_per_second']:.1f} images/s)")
+        return result
+    except LaneBusyError:
+        raise
+    except Exception as e:
+        logging.error(f"failed to embed images: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.delete("/embed/notes/{note_id}")
 async def delete_note_route(note_id: int):
     try:
-        delete_note_embeddings(note_id)
+        await delete_note_embeddings(note_id)
         return {"success": True}
     except Exception as e:
         logging.error(f"failed to delete note embeddings {note_id}: {e}")
@@ -76,8 +148,250 @@ async def delete_note_route(note_id: int):
 @router.delete("/embed/images/{filename}")
 async def delete_image_route(filename: str):
     try:
-        delete_image_embeddings(filename)
+        await delete_image_embeddings(filename)
         return {"success": True}
     except Exception as e:
         logging.error(f"failed to delete image embeddings {filename}: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/embed/cache")
+async def embedding_cache_route():
+    return get_cache_stats()
+
+
+
+async def stream_bulk_embed_results(body: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    start = time.time()
+    progress = {"processed": 0, "failed": 0}
+    pending = None
+    error = None
+
+    def to_lines(results: List[Dict[str, Any]]) -> List[str]:
+        for result in results:
+            progress["processed" if result["success"] else "failed"] += 1
+        elapsed = time.time() - start
+        total = progress["processed"] + progress["failed"]
+        summary = {"progress": {**progress, "elapsed": round(elapsed, 3), "notes_per_second": round(total / elapsed, 2) if elapsed else 0.0}}
+        return [json.dumps(result) + "\n" for result in results] + [json.dumps(summary) + "\n"]
+
+    try:
+        # the next batch is read and parsed while the previous one is chunked, embedded and written
+        async for notes, entries in read_note_batches(body):
+            if pending is not None:
+                for line in to_lines(await pending):
+                    yield line
+                pending = None
+
+            if notes:
+                pending = asyncio.ensure_future(embed_entries(notes, entries))
+            else:
+                for line in to_lines(entries):
+                    yield line
+    except ClientDisconnect:
+        logging.warning("client disconnected during bulk embed request")
+    except ValueError as e:
+        logging.error(f"failed to read bulk embed request: {e}")
+        error = {"success": False, "error": f"invalid request body: {e}"}
+
+    if pending is not None:
+        for line in to_lines(await pending):
+            yield line
+    if error is not None:
+        yield json.dumps(error) + "\n"
+
+    elapsed = time.time() - start
+    logging.info(f"bulk embedded {progress['processed']} notes, {progress['failed']} failed ({elapsed:.2f}s)")
+
+
+async def embed_entries(notes: List[NoteInput], entries: List[Dict[str, Any] | None]) -> List[Dict[str, Any]]:
+    # entries are the batch in input order, invalid lines hold their result and notes None until they are embedded
+    results = iter(await run_ingest_with_backpressure(embed_note_batch, notes))
+    return [next(results) if entry is None else entry for entry in entries]
+
+
+async def run_ingest_with_backpressure(fn, *args):
+    # a busy ingest lane pauses the stream (and with it reading the request body) instead of failing it
+    while True:
+        try:
+            return await run_ingest(fn, *args)
+        except LaneBusyError:
+            await asyncio.sleep(BULK_BACKOFF_SECONDS)
+
+
+def embed_note_batch(notes: List[NoteInput]) -> List[Dict[str, Any]]:
+    try:
+        return [{**result, "success": True} for result in process_notes(notes)]
+    except INFRASTRUCTURE_ERRORS as e:
+        logging.error(f"failed to embed batch of {len(notes)} notes: {e}")
+        return [{"note_id": note["note_id"], "success": False, "error": str(e)} for note in notes]
+    except Exception as e:
+        if len(notes) == 1:
+            logging.error(f"failed to embed note {notes[0]['note_id']}: {e}")
+            return [{"note_id": notes[0]["note_id"], "success": False, "error": str(e)}]
+
+        # bisect to isolate the failing note(s) so the rest of the batch still gets indexed, a single bad note
+        # costs about 2 * log2(batch size) extra rounds, notes already written are skipped by their content hash
+        logging.warning(f"failed to embed batch of {len(notes)} notes, splitting it: {e}")
+        middle = len(notes) // 2
+        return embed_note_batch(notes[:middle]) + embed_note_batch(notes[middle:])
+
+
+async def read_note_batches(body: AsyncIterator[bytes]) -> AsyncIterator[Tuple[List[NoteInput], List[Dict[str, Any] | None]]]:
+    notes: List[NoteInput] = []
+    entries: List[Dict[str, Any] | None] = []
+    note_ids = set()
+    chars = 0
+
+    async for obj in iter_json_objects(body):
+        try:
+            note = BulkEmbedNoteRequest.model_validate(obj)
+        except ValidationError as e:
+            note_id = obj.get("note_id") if isinstance(obj, dict) else None
+            entries.append({"note_id": note_id, "success": False, "error": str(e)})
+            continue
+
+        # a note id may appear only once per batch, later updates go into the next one
+        is_full = len(notes) >= BULK_NOTE_BATCH_SIZE or chars + len(note.content) > BULK_BATCH_MAX_CHARS
+        if notes and (is_full or note.note_id in note_ids):
+            yield notes, entries
+            notes, entries, note_ids, chars = [], [], set(), 0
+
+        notes.append({"note_id": note.note_id, "title": note.title, "content": note.content, "tags": note.tags, "updated_at": note.updated_at})
+        entries.append(None)
+        note_ids.add(note.note_id)
+        chars += len(note.content)
+
+    if entries:
+        yield notes, entries
+
+
+async def iter_json_objects(body: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    # NDJSON or a JSON array, told apart by the first character. Every character is scanned once and only complete
+    # values are decoded, so a large note costs linear time, and values over BULK_THREAD_DECODE_CHARS leave the loop
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    splitter: NdjsonSplitter | JsonArraySplitter | None = None
+
+    async for data in body:
+        text = utf8.decode(data)
+        if splitter is None:
+            text = text.lstrip()
+            if not text:
+                continue
+            splitter = JsonArraySplitter() if text[0] == "[" else NdjsonSplitter()
+
+        for value in splitter.feed(text):
+            yield await decode_json(value)
+        if splitter.pending_chars > BULK_MAX_OBJECT_CHARS:
+            raise ValueError(f"note exceeds {BULK_MAX_OBJECT_CHARS} characters or is not valid JSON")
+
+    if splitter is not None:
+        for value in [*splitter.feed(utf8.decode(b"", final=True)), *splitter.finish()]:
+            yield await decode_json(value)
+
+
+async def decode_json(value: str) -> Any:
+    if len(value) >= BULK_THREAD_DECODE_CHARS:
+        return await asyncio.to_thread(json.loads, value)
+    return json.loads(value)
+
+
+class NdjsonSplitter:
+    # complete lines are returned as they arrive, the unfinished last line is kept as pieces so it is joined only once
+    def __init__(self):
+        self.pieces: List[str] = []
+        self.pending_chars = 0
+
+    def feed(self, text: str) -> List[str]:
+        lines = text.split("\n")
+        values = []
+        for line in lines[:-1]:
+            value = ("".join(self.pieces) + line).strip() if self.pieces else line.strip()
+            self.pieces = []
+            if value:
+                values.append(value)
+
+        if lines[-1]:
+            self.pieces.append(lines[-1])
+        self.pending_chars = sum(len(piece) for piece in self.pieces)
+        return values
+
+    def finish(self) -> List[str]:
+        value = "".join(self.pieces).strip()
+        self.pieces = []
+        return [value] if value else []
+
+
+json_string_body_regex = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*')
+json_structure_regex = re.compile(r'["{}\[\],]')
+
+
+class JsonArraySplitter:
+    # finds the end of each element of a top level JSON array, keeping string, escape and nesting state between
+    # chunks. A string body is consumed by one regex match, outside strings the scan jumps from bracket to bracket
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.closed = False
+        self.pieces: List[str] = []
+        self.pending_chars = 0
+
+    def feed(self, text: str) -> List[str]:
+        values = []
+        element_start = 0
+        position = 0
+
+        while position < len(text) and not self.closed:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                    position += 1
+                # the rest of the string body, escapes included, in one match
+                position = json_string_body_regex.match(text, position).end()
+                if position == len(text):
+                    break
+                if text[position] == "\\":
+                    self.escaped = True
+                else:
+                    self.in_string = False
+                position += 1
+                continue
+
+            match = json_structure_regex.search(text, position)
+            if match is None:
+                break
+            position = match.end()
+            char = match.group()
+
+            if char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+                if self.depth == 1:
+                    element_start = position
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    values.extend(self.take(text[element_start:match.start()]))
+                    self.closed = True
+            elif char == "," and self.depth == 1:
+                values.extend(self.take(text[element_start:match.start()]))
+                element_start = position
+
+        if self.depth >= 1 and not self.closed:
+            self.pieces.append(text[element_start:])
+            self.pending_chars += len(self.pieces[-1])
+        return values
+
+    def take(self, tail: str) -> Iterator[str]:
+        value = ("".join(self.pieces) + tail).strip() if self.pieces else tail.strip()
+        self.pieces = []
+        self.pending_chars = 0
+        if value:
+            yield value
+
+    def finish(self) -> List[str]:
+        if not self.closed:
+            raise ValueError("JSON array is not closed")
+        return []
@@ -1,67 +1,362 @@
+import os
+import time
+import json
+import hashlib
 import logging
 import uuid
-from typing import List
-from features.chunking.chunking_service import chunk_note
-from commons.qdrant.qdrant_client import (upsert_points, delete_points_by_filter)
-from commons.qdrant.qdrant_helper import NOTE_COLLECTION, IMAGE_COLLECTION, embed_image, embed_text
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Tuple, Dict, Any, Set, TypedDict
+from features.chunking import chunking_service
+from features.chunking.chunking_service import STREAMING_CHUNK_THRESHOLD, chunk_notes, chunk_notes_with_vectors, stream_note_chunks
+from features.chunking.segmentation_service import SENTENCE_SEGMENTER
+from features.similarity.similarity_service import invalidate_outlier_cache
+from features.similarity.related_notes_service import mark_notes_changed
+from commons.metrics.metrics import timed_stage
+from commons.qdrant import qdrant_async_client
+from commons.qdrant.qdrant_client import (upsert_points, delete_points, delete_points_by_filter, scroll_points, set_payloads)
+from commons.qdrant.qdrant_helper import NOTE_COLLECTION, IMAGE_COLLECTION, TEXT_EMBED_MODEL, embed_images, embed_texts, load_image
+
+
+# "chunk" embeds each chunk's text with the model, "sentence" pools the sentence vectors computed by the chunker
+CHUNK_EMBEDDING_MODES = ("chunk", "sentence")
+CHUNK_EMBEDDING_MODE = os.getenv("CHUNK_EMBEDDING_MODE", "chunk")
+
+if CHUNK_EMBEDDING_MODE not in CHUNK_EMBEDDING_MODES:
+    raise ValueError(f"Invalid CHUNK_EMBEDDING_MODE: {CHUNK_EMBEDDING_MODE} (expected one of {', '.join(CHUNK_EMBEDDING_MODES)})")
+
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1c8a52-3e0b-4d8e-9a57-2b4f7c1d9e30")
+# everything that decides a note's chunks and their vectors. It is part of content hashes and chunk ids, so after
+# a change of model, embedding mode, segmenter or chunking thresholds unchanged notes are embedded again instead of
+# keeping vectors made the old way
+CHUNKING_FINGERPRINT = hashlib.sha256(json.dumps({
+    "model": TEXT_EMBED_MODEL,
+    "embedding_mode": CHUNK_EMBEDDING_MODE,
+    "segmenter": SENTENCE_SEGMENTER,
+    "break_threshold": chunking_service.CHUNK_BREAK_THRESHOLD,
+    "min_sentences": chunking_service.MIN_SENTENCES_PER_CHUNK,
+    "max_sentences": chunking_service.MAX_SENTENCES_PER_CHUNK,
+    "min_chunk_length": chunking_service.MIN_CHUNK_LENGTH,
+    "streaming_threshold": chunking_service.STREAMING_CHUNK_THRESHOLD,
+    "segment_chars": chunking_service.STREAM_SEGMENT_CHARS,
+}, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+# everything process_notes compares, chunk texts are not needed
+EXISTING_POINT_PAYLOAD = ["note_id", "title", "tags", "updated_at", "content_hash", "chunk_index"]
+# new chunk points are written in batches of this size, chunks of a streamed note are embedded STREAMED_CHUNK_BATCH_SIZE at a time
+NOTE_UPSERT_BATCH_SIZE = int(os.getenv("NOTE_UPSERT_BATCH_SIZE", "256"))
+STREAMED_CHUNK_BATCH_SIZE = 64
+
+IMAGE_ID_NAMESPACE = uuid.UUID("0b7d4e2a-91c6-4f35-8d1e-6a2c5f9b3e47")
+IMAGE_BATCH_SIZE = int(os.getenv("IMAGE_BATCH_SIZE", "16"))
+IMAGE_DECODE_WORKERS = int(os.getenv("IMAGE_DECODE_WORKERS", "4"))
+
+
+class NoteInput(TypedDict):
+    note_id: int
+    title: str
+    content: str
+    tags: List[str]
+    updated_at: str
+
+
+class NoteResult(TypedDict):
+    note_id: int
+    chunks: int
+    embedded: int
+    removed: int
+
 
 def process_note(note_id: int, title: str, content: str, tags: List[str], updated_at: str) -> None:
-    delete_note_embeddings(note_id)
+    process_notes([{"note_id": note_id, "title": title, "content": content, "tags": tags, "updated_at": updated_at}])
+
+
+@timed_stage("process_notes")
+def process_notes(notes: List[NoteInput]) -> List[NoteResult]:
+    # note ids must be unique within one call, all notes share one scroll, one model pass and one write per operation
+    existing_points: Dict[int, Dict[str, Dict[str, Any]]] = {note["note_id"]: {} for note in notes}
+    for point in scroll_points(NOTE_COLLECTION, {"note_id": list(existing_points)}, with_payload=EXISTING_POINT_PAYLOAD):
+        existing_points[point["payload"]["note_id"]][point["id"]] = point["payload"]
+
+    results: Dict[int, NoteResult] = {}
+    filter_payloads = []
+    changed_notes = []
+
+    for note in notes:
+        note_id = note["note_id"]
+        note_payload = build_note_payload(note)
+        note_points = existing_points[note_id]
+
+        if note_points and all(payload.get("content_hash") == note_payload["content_hash"] for payload in note_points.values()):
+            if is_payload_changed(note_points, note_payload):
+                filter_payloads.append(({"note_id": note_id}, note_payload))
+                logging.debug(f"Updating payload of note {note_id} without re-embedding")
+            results[note_id] = {"note_id": note_id, "chunks": len(note_points), "embedded": 0, "removed": 0}
+            continue
+
+        changed_notes.append((note, note_payload))
+
+    # notes above STREAMING_CHUNK_THRESHOLD are chunked, embedded and written while they are read, the others together
+    batched_notes = [(note, note_payload) for note, note_payload in changed_notes if len(note["content"]) <= STREAMING_CHUNK_THRESHOLD]
+    streamed_notes = [(note, note_payload) for note, note_payload in changed_notes if len(note["content"]) > STREAMING_CHUNK_THRESHOLD]
 
-    chunks = chunk_note(content)
-    if not chunks:
-        return
+    embedded_notes = embed_notes_chunks(
+        [note["content"] for note, _ in batched_notes],
+        [note["note_id"] for note, _ in batched_notes],
+        [set(existing_points[note["note_id"]]) for note, _ in batched_notes],
+    )
+    note_chunk_points: List[Tuple[NoteInput, Dict[str, Any], Iterable[Tuple[str, str, List[float] | None]]]] = [
+        (note, note_payload, zip(chunk_point_ids(note["note_id"], chunks), chunks, embeddings))
+        for (note, note_payload), (chunks, embeddings) in zip(batched_notes, embedded_notes)
+    ]
+    note_chunk_points.extend(
+        (note, note_payload, stream_note_chunk_points(note["note_id"], note["content"], set(existing_points[note["note_id"]])))
+        for note, note_payload in streamed_notes
+    )
 
     points = []
-    for i, chunk in enumerate(chunks):
-        embedding = embed_text(chunk)
-        point = {
-            "id": str(uuid.uuid4()),
-            "vector": embedding,
-            "payload": {
-                "text": chunk,
-                "note_id": note_id,
-                "chunk_index": i,
-                "title": title,
-                "tags": tags,
-                "updated_at": updated_at,
+    payload_updates = {}
+    stale_ids = []
+
+    for note, note_payload, chunk_points in note_chunk_points:
+        note_id = note["note_id"]
+        note_points = existing_points[note_id]
+        current_ids = set()
+        embedded = 0
+
+        for i, (chunk_id, chunk, embedding) in enumerate(chunk_points):
+            current_ids.add(chunk_id)
+            if chunk_id in note_points:
+                if note_points[chunk_id].get("chunk_index") != i:
+                    payload_updates[chunk_id] = {"chunk_index": i}
+                continue
+
+            point = {
+                "id": chunk_id,
+                "vector": embedding,
+                "payload": {
+                    "text": chunk,
+                    "chunk_index": i,
+                    **note_payload,
+                }
             }
-        }
-        points.append(point)
+            points.append(point)
+            embedded += 1
+
+            if len(points) >= NOTE_UPSERT_BATCH_SIZE:
+                upsert_points(NOTE_COLLECTION, points)
+                points = []
+
+        chunks = len(current_ids)
+        if embedded < chunks:
+            filter_payloads.append(({"note_id": note_id}, note_payload))
+
+        note_stale_ids = [point_id for point_id in note_points if point_id not in current_ids]
+        stale_ids.extend(note_stale_ids)
+
+        results[note_id] = {"note_id": note_id, "chunks": chunks, "embedded": embedded, "removed": len(note_stale_ids)}
+        logging.debug(f"Processed note {note_id} with {chunks} chunks ({embedded} embedded, {len(note_stale_ids)} removed)")
+
+    # new points are written before stale ones are removed so a note never disappears from search
+    if points:
+        upsert_points(NOTE_COLLECTION, points)
+
+    set_payloads(NOTE_COLLECTION, payload_updates, filter_payloads)
+    delete_points(NOTE_COLLECTION, stale_ids)
+
+    for note, _ in changed_notes:
+        invalidate_outlier_cache(note["note_id"])
+    # payload changes matter too, related notes entries carry titles and tags
+    mark_notes_changed([note["note_id"] for note, _ in changed_notes] + [conditions["note_id"] for conditions, _ in filter_payloads])
+
+    return [results[note["note_id"]] for note in notes]
+
+
+def build_note_payload(note: NoteInput) -> Dict[str, Any]:
+    return {
+        "note_id": note["note_id"],
+        "title": note["title"],
+        "tags": note["tags"],
+        "updated_at": note["updated_at"],
+        "content_hash": hash_text(f"{CHUNKING_FINGERPRINT}:{note['content']}"),
+    }
+
+
+def is_payload_changed(note_points: Dict[str, Dict[str, Any]], note_payload: Dict[str, Any]) -> bool:
+    return any(payload.get(key) != value for payload in note_points.values() for key, value in note_payload.items())
 
-    upsert_points(NOTE_COLLECTION, points)
-    logging.debug(f"Processed note {note_id} with {len(chunks)} chunks")
+
+def embed_note_chunks(content: str, mode: str = CHUNK_EMBEDDING_MODE) -> Tuple[List[str], List[List[float]]]:
+    return embed_notes_chunks([content], [0], [set()], mode=mode)[0]
+
+
+def embed_notes_chunks(contents: List[str], note_ids: List[int], skip_ids: List[Set[str]], mode: str = CHUNK_EMBEDDING_MODE) -> List[Tuple[List[str], List[List[float] | None]]]:
+    # chunks whose point id is in the note's skip_ids are already stored and get None instead of a vector
+    if mode == "sentence":
+        return chunk_notes_with_vectors(contents)
+
+    chunk_lists = chunk_notes(contents)
+
+    to_embed = []
+    for n, (chunks, note_id, note_skip_ids) in enumerate(zip(chunk_lists, note_ids, skip_ids)):
+        for i, chunk_id in enumerate(chunk_point_ids(note_id, chunks)):
+            if chunk_id not in note_skip_ids:
+                to_embed.append((n, i))
+
+    embeddings = embed_texts([chunk_lists[n][i] for n, i in to_embed])
+
+    results = [(chunks, [None] * len(chunks)) for chunks in chunk_lists]
+    for (n, i), embedding in zip(to_embed, embeddings):
+        results[n][1][i] = embedding
+    return results
+
+
+def stream_note_chunk_points(note_id: int, content: str, skip_ids: Set[str], mode: str = CHUNK_EMBEDDING_MODE) -> Iterator[Tuple[str, str, List[float] | None]]:
+    # (point id, chunk, vector) of a streamed note, chunks whose id is in skip_ids are not embedded in chunk mode
+    occurrences: Dict[str, int] = {}
+    batch = []
+    for chunk, vector in stream_note_chunks(content, with_vectors=mode == "sentence"):
+        batch.append((next_chunk_point_id(note_id, chunk, occurrences), chunk, vector))
+        if len(batch) >= STREAMED_CHUNK_BATCH_SIZE:
+            yield from embed_chunk_batch(batch, skip_ids, mode)
+            batch = []
+    yield from embed_chunk_batch(batch, skip_ids, mode)
+
+
+def embed_chunk_batch(batch: List[Tuple[str, str, List[float] | None]], skip_ids: Set[str], mode: str) -> List[Tuple[str, str, List[float] | None]]:
+    if mode == "sentence":
+        return batch
+
+    to_embed = [i for i, (chunk_id, _, _) in enumerate(batch) if chunk_id not in skip_ids]
+    vectors: List[List[float] | None] = [None] * len(batch)
+    for i, embedding in zip(to_embed, embed_texts([batch[i][1] for i in to_embed])):
+        vectors[i] = embedding
+    return [(chunk_id, chunk, vector) for (chunk_id, chunk, _), vector in zip(batch, vectors)]
+
+
+def chunk_point_ids(note_id: int, chunks: List[str]) -> List[str]:
+    occurrences: Dict[str, int] = {}
+    return [next_chunk_point_id(note_id, chunk, occurrences) for chunk in chunks]
+
+
+def next_chunk_point_id(note_id: int, chunk: str, occurrences: Dict[str, int]) -> str:
+    # ids derive from note id, chunking config and chunk content, repeated chunks are told apart by occurrence
+    chunk_hash = hash_text(chunk)
+    occurrence = occurrences.get(chunk_hash, 0)
+    occurrences[chunk_hash] = occurrence + 1
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{note_id}:{CHUNKING_FINGERPRINT}:{chunk_hash}:{occurrence}"))
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ImageInput(TypedDict):
+    filename: str
+    image_path: str
+    width: int
+    height: int
+    aspect_ratio: float
+    file_size: int
+    format: str
+
+
+class ImageFailure(TypedDict):
+    filename: str
+    error: str
+
+
+class ImageBatchResult(TypedDict):
+    processed: int
+    failed: List[ImageFailure]
+    elapsed: float
+    images_per_second: float
 
 
 def process_image(filename: str, image_path: str, width: int, height: int, aspect_ratio: float, file_size: int, format: str) -> None:
-    delete_image_embeddings(filename)
+    image: ImageInput = {"filename": filename, "image_path": image_path, "width": width, "height": height, "aspect_ratio": aspect_ratio, "file_size": file_size, "format": format}
+    result = process_images([image])
+    if result["failed"]:
+        raise RuntimeError(result["failed"][0]["error"])
 
-    embedding = embed_image(image_path)
 
-    payload = {
-        "filename": filename,
-        "width": width,
-        "height": height,
-        "aspectRatio": aspect_ratio,
-        "fileSize": file_size,
-        "format": format,
+@timed_stage("process_images")
+def process_images(images: List[ImageInput]) -> ImageBatchResult:
+    # images are decoded in a thread pool one batch ahead of the model, failures are reported per file
+    start = time.time()
+    processed = 0
+    failed: List[ImageFailure] = []
+    batches = [images[i:i + IMAGE_BATCH_SIZE] for i in range(0, len(images), IMAGE_BATCH_SIZE)]
+
+    with ThreadPoolExecutor(max_workers=IMAGE_DECODE_WORKERS) as executor:
+        next_decoded = [executor.submit(load_image, image["image_path"]) for image in batches[0]] if batches else []
+
+        for n, batch in enumerate(batches):
+            decoded = next_decoded
+            if n + 1 < len(batches):
+                next_decoded = [executor.submit(load_image, image["image_path"]) for image in batches[n + 1]]
+
+            loaded = []
+            for image, future in zip(batch, decoded):
+                try:
+                    loaded.append((image, *future.result()))
+                except Exception as e:
+                    logging.error(f"failed to load image {image['filename']}: {e}")
+                    failed.append({"filename": image["filename"], "error": str(e)})
+
+            if not loaded:
+                continue
+
+            try:
+                embeddings = embed_images([pixels for _, pixels, _ in loaded], [content for _, _, content in loaded])
+                points = [
+                    {
+                        "id": image_point_id(image["filename"]),
+                        "vector": embedding,
+                        "payload": build_image_payload(image, content),
+                    }
+                    for (image, _, content), embedding in zip(loaded, embeddings)
+                ]
+                delete_points_by_filter(IMAGE_COLLECTION, {"filename": [image["filename"] for image, _, _ in loaded]})
+                upsert_points(IMAGE_COLLECTION, points)
+                processed += len(points)
+            except Exception as e:
+                logging.error(f"failed to embed batch of {len(loaded)} images: {e}")
+                failed.extend({"filename": image["filename"], "error": str(e)} for image, _, _ in loaded)
+
+    elapsed = time.time() - start
+    logging.debug(f"Processed {processed} images, {len(failed)} failed ({elapsed:.2f}s)")
+    return {
+        "processed": processed,
+        "failed": failed,
+        "elapsed": elapsed,
+        "images_per_second": processed / elapsed if elapsed else 0.0,
     }
 
-    point = {
-        "id": str(uuid.uuid4()),
-        "vector": embedding,
-        "payload": payload
+
+def build_image_payload(image: ImageInput, content: bytes) -> Dict[str, Any]:
+    # content_hash tells a re-embedded image apart from the old point of the same id (see migrate_collection)
+    return {
+        "filename": image["filename"],
+        "width": image["width"],
+        "height": image["height"],
+        "aspectRatio": image["aspect_ratio"],
+        "fileSize": image["file_size"],
+        "format": image["format"],
+        "content_hash": hashlib.sha256(content).hexdigest(),
     }
 
-    upsert_points(IMAGE_COLLECTION, [point])
-    logging.debug(f"Processed image {filename}")
+
+def image_point_id(filename: str) -> str:
+    return str(uuid.uuid5(IMAGE_ID_NAMESPACE, filename))
 
 
-def delete_note_embeddings(note_id: int) -> None:
-    delete_points_by_filter(NOTE_COLLECTION, {"note_id": note_id})
+async def delete_note_embeddings(note_id: int) -> None:
+    # a single filtered delete, awaited on the event loop instead of taking an ingest lane thread
+    await qdrant_async_client.delete_points_by_filter(NOTE_COLLECTION, {"note_id": note_id})
+    invalidate_outlier_cache(note_id)
+    mark_notes_changed([note_id])
     logging.debug(f"Deleted embeddings for note {note_id}")
 
 
-def delete_image_embeddings(filename: str) -> None:
-    delete_points_by_filter(IMAGE_COLLECTION, {"filename": filename})
+async def delete_image_embeddings(filename: str) -> None:
+    await qdrant_async_client.delete_points_by_filter(IMAGE_COLLECTION, {"filename": filename})
     logging.debug(f"Deleted embeddings for image {filename}")
\ No newline at end of file
@@ -0,0 +1,42 @@
+from typing import Dict
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from commons.cache.embedding_cache import get_cache_stats
+from commons.executors.lane_executor import get_lane_stats
+from commons.metrics.metrics import CallbackMetric, Labels, render
+from features.search.search_service import get_search_cache_stats
+from features.similarity.similarity_service import get_outlier_cache_stats
+
+
+router = APIRouter()
+
+
+def read_cache_lookups() -> Dict[Labels, float]:
+    caches = {"embeddings": get_cache_stats(), "outliers": get_outlier_cache_stats(), **get_search_cache_stats()}
+    values = {}
+    for cache, stats in caches.items():
+        values[(cache, "hit")] = stats["hits"]
+        values[(cache, "miss")] = stats["misses"]
+    return values
+
+
+def read_lane_tasks() -> Dict[Labels, float]:
+    values = {}
+    for lane, stats in get_lane_stats().items():
+        values[(lane, "running")] = stats["running"]
+        values[(lane, "queued")] = stats["queued"]
+    return values
+
+
+def read_lane_rejections() -> Dict[Labels, float]:
+    return {(lane,): stats["rejected"] for lane, stats in get_lane_stats().items()}
+
+
+CallbackMetric("zen_cache_lookups_total", "Cache lookups by result", "counter", ("cache", "result"), read_cache_lookups)
+CallbackMetric("zen_lane_tasks", "Tasks running or queued on an executor lane", "gauge", ("lane", "state"), read_lane_tasks)
+CallbackMetric("zen_lane_rejected_total", "Tasks rejected by a full executor lane", "counter", ("lane",), read_lane_rejections)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics_route():
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4; charset=utf-8")
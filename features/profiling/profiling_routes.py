@@ -0,0 +1,61 @@
+import hmac
+import time
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from commons.profiling.sampling_profiler import (PROFILER_ADMIN_TOKEN, PROFILER_INTERVAL_MS, PROFILER_MAX_SECONDS, ProfilerBusyError, SamplingProfiler,
+                                                 profile_for, profile_requests)
+
+
+def require_admin_token(x_admin_token: str = Header("")) -> None:
+    # without PROFILER_ADMIN_TOKEN the routes do not exist as far as clients can tell
+    if not PROFILER_ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(x_admin_token, PROFILER_ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="invalid admin token")
+
+
+router = APIRouter(prefix="/admin/profile", dependencies=[Depends(require_admin_token)])
+
+FORMATS = "^(collapsed|speedscope)$"
+
+
+def to_response(profiler: SamplingProfiler, name: str, format: str, headers: dict) -> Response:
+    headers = {**headers, "X-Profile-Samples": str(profiler.samples)}
+    if format == "speedscope":
+        filename = f"{name}-{int(time.time())}.speedscope.json"
+        return JSONResponse(profiler.to_speedscope(name), headers={**headers, "Content-Disposition": f'attachment; filename="{filename}"'})
+    return PlainTextResponse(profiler.to_collapsed(), headers=headers)
+
+
+@router.post("")
+async def profile_route(
+    seconds: float = Query(10, gt=0, le=PROFILER_MAX_SECONDS),
+    format: str = Query("collapsed", pattern=FORMATS),
+    interval_ms: float = Query(PROFILER_INTERVAL_MS, ge=1, le=1000),
+    include_idle: bool = False,
+):
+    try:
+        profiler = await profile_for(seconds, interval_ms, include_idle)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return to_response(profiler, "profile", format, {})
+
+
+@router.post("/requests")
+async def profile_requests_route(
+    request: Request,
+    route: str,
+    count: int = Query(10, gt=0, le=10000),
+    timeout: float = Query(60, gt=0, le=PROFILER_MAX_SECONDS),
+    format: str = Query("collapsed", pattern=FORMATS),
+    interval_ms: float = Query(PROFILER_INTERVAL_MS, ge=1, le=1000),
+    include_idle: bool = False,
+):
+    if route not in {getattr(app_route, "path", None) for app_route in request.app.routes}:
+        raise HTTPException(status_code=400, detail=f"unknown route {route}, expected a template such as /embed/notes/{{note_id}}")
+
+    try:
+        profiler, finished = await profile_requests(route, count, timeout, interval_ms, include_idle)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return to_response(profiler, "requests", format, {"X-Profiled-Requests": str(finished)})
@@ -1,22 +1,55 @@
+import os
 import logging
+from datetime import datetime
+from typing import List
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from features.search.search_service import search_notes, search_images
+from pydantic import BaseModel, Field, model_validator
+from features.search.search_service import search_notes, search_images, get_search_cache_stats
+from commons.qdrant.qdrant_helper import get_query_batching_stats
+from commons.qdrant.qdrant_async_client import MAX_GROUP_WINDOW
+from commons.executors.lane_executor import LaneBusyError
 
 
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "100"))
+# deepest result a note search may page to, a page costs a group search for offset + limit notes. It cannot go past
+# what the prefetch cap of a two stage collection can fill, raise QDRANT_MAX_PREFETCH_CANDIDATES for deeper pages
+SEARCH_MAX_WINDOW = min(int(os.getenv("SEARCH_MAX_WINDOW", str(MAX_GROUP_WINDOW))), MAX_GROUP_WINDOW)
+
 router = APIRouter()
 
 
 class SearchRequest(BaseModel):
     query: str
-    limit: int = 20
+    limit: int = Field(20, gt=0, le=SEARCH_MAX_LIMIT)
+
+
+class NoteSearchRequest(SearchRequest):
+    offset: int = Field(0, ge=0)
+    tags: List[str] | None = None
+    updated_after: datetime | None = None
+    updated_before: datetime | None = None
+
+    @model_validator(mode="after")
+    def check_window(self):
+        if self.offset + self.limit > SEARCH_MAX_WINDOW:
+            raise ValueError(f"offset + limit must not exceed {SEARCH_MAX_WINDOW}")
+        return self
 
 
 @router.post("/search/notes")
-async def search_notes_route(request: SearchRequest):
+async def search_notes_route(request: NoteSearchRequest):
     try:
-        results = search_notes(query=request.query, limit=request.limit)
+        results = await search_notes(
+            query=request.query,
+            limit=request.limit,
+            offset=request.offset,
+            tags=request.tags,
+            updated_after=request.updated_after.isoformat() if request.updated_after else None,
+            updated_before=request.updated_before.isoformat() if request.updated_before else None,
+        )
         return {"results": results}
+    except LaneBusyError:
+        raise
     except Exception as e:
         logging.error(f"failed to search notes: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -25,8 +58,15 @@ async def search_notes_route(request: SearchRequest):
 @router.post("/search/images")
 async def search_images_route(request: SearchRequest):
     try:
-        results = search_images(query=request.query, limit=request.limit)
+        results = await search_images(query=request.query, limit=request.limit)
         return {"results": results}
+    except LaneBusyError:
+        raise
     except Exception as e:
         logging.error(f"failed to search images: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/search/stats")
+async def search_stats_route():
+    return {"batching": get_query_batching_stats(), "caches": get_search_cache_stats()}
@@ -1,13 +1,25 @@
-from typing import List, TypedDict
-from commons.qdrant.qdrant_helper import embed_text, embed_query_for_images
-from commons.qdrant.qdrant_client import search_similar
+import os
+from typing import Any, Awaitable, Callable, Dict, List, TypedDict
+from commons.cache.ttl_cache import TTLCache
+from commons.qdrant.qdrant_helper import NOTE_COLLECTION, IMAGE_COLLECTION, TEXT_EMBED_MODEL, IMAGE_QUERY_MODEL, embed_query_async, embed_query_for_images_async
+from commons.qdrant.qdrant_client import get_collection_version
+from commons.qdrant.qdrant_async_client import search_groups, search_similar
 
 
-NOTE_COLLECTION = "notes_v1"
-IMAGE_COLLECTION = "images_v1"
 NOTE_SCORE_THRESHOLD = 0.55
 IMAGE_SCORE_THRESHOLD = 0.25
 
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "600"))
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "30"))
+
+
+query_vector_cache = TTLCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL_SECONDS)
+# keyed by collection version, so writes through qdrant_client invalidate it, the TTL bounds
+# staleness from writes made by other processes
+result_cache = TTLCache(QUERY_CACHE_SIZE if RESULT_CACHE_ENABLED else 0, RESULT_CACHE_TTL_SECONDS)
+
 
 class NoteSearchResult(TypedDict):
     noteId: int
@@ -29,45 +41,70 @@ class ImageSearchResult(TypedDict):
     score: float
 
 
-def search_notes(query: str, limit: int = 20) -> List[NoteSearchResult]:
-    if len(query.strip()) < 3:
+async def search_notes(query: str, limit: int = 20, offset: int = 0, tags: List[str] | None = None, updated_after: str | None = None, updated_before: str | None = None) -> List[NoteSearchResult]:
+    # returns up to limit distinct notes with their best chunk, offset skips notes of earlier pages
+    # tags match notes with any of them, updated_after / updated_before are inclusive RFC 3339 bounds
+    query = normalize_query(query)
+    if len(query) < 3:
         return []
 
-    query_vector = embed_text(query)
+    filter = build_note_filter(tags, updated_after, updated_before)
+    result_key = (NOTE_COLLECTION, get_collection_version(NOTE_COLLECTION), query, limit, offset, tuple(sorted(tags or [])), updated_after, updated_before)
+    cached = result_cache.get(result_key)
+    if cached is not None:
+        return cached
 
-    results = search_similar(collection_name=NOTE_COLLECTION, query_vector=query_vector, limit=limit, threshold=NOTE_SCORE_THRESHOLD)
+    query_vector = await get_query_vector(TEXT_EMBED_MODEL, query, embed_query_async)
 
-    note_map = {}
-    for result in results:
+    groups = await search_groups(collection_name=NOTE_COLLECTION, query_vector=query_vector, group_by="note_id", limit=limit, offset=offset, filter=filter, threshold=NOTE_SCORE_THRESHOLD)
+
+    matches = []
+    for group in groups:
+        result = group["hits"][0]
         payload = result["payload"]
-        note_id = payload.get("note_id")
+        matches.append({
+            "noteId": group["group_id"],
+            "chunkId": result["id"],
+            "title": payload["title"],
+            "matchText": payload["text"],
+            "tags": payload["tags"],
+            "updatedAt": payload["updated_at"],
+            "score": result["score"],
+        })
+
+    result_cache.set(result_key, matches)
+    return matches
 
-        if note_id is None:
-            continue
 
-        if note_id not in note_map or result["score"] > note_map[note_id]["score"]:
-            note_map[note_id] = {
-                "noteId": note_id,
-                "chunkId": result["id"],
-                "title": payload["title"],
-                "matchText": payload["text"],
-                "tags": payload["tags"],
-                "updatedAt": payload["updated_at"],
-                "score": result["score"],
-            }
+def build_note_filter(tags: List[str] | None, updated_after: str | None, updated_before: str | None) -> Dict[str, Any]:
+    filter: Dict[str, Any] = {}
+    if tags:
+        filter["tags"] = tags
 
-    matches = list(note_map.values())
-    matches.sort(key=lambda x: x["score"], reverse=True)
+    updated_at = {}
+    if updated_after:
+        updated_at["gte"] = updated_after
+    if updated_before:
+        updated_at["lte"] = updated_before
+    if updated_at:
+        filter["updated_at"] = updated_at
+
+    return filter
 
-    return matches
 
-def search_images(query: str, limit: int = 20) -> List[ImageSearchResult]:
-    if len(query.strip()) < 3:
+async def search_images(query: str, limit: int = 20) -> List[ImageSearchResult]:
+    query = normalize_query(query)
+    if len(query) < 3:
         return []
 
-    query_vector = embed_query_for_images(query)
+    result_key = (IMAGE_COLLECTION, get_collection_version(IMAGE_COLLECTION), query, limit)
+    cached = result_cache.get(result_key)
+    if cached is not None:
+        return cached
+
+    query_vector = await get_query_vector(IMAGE_QUERY_MODEL, query, embed_query_for_images_async)
 
-    results = search_similar(collection_name=IMAGE_COLLECTION, query_vector=query_vector, limit=limit, threshold=IMAGE_SCORE_THRESHOLD)
+    results = await search_similar(collection_name=IMAGE_COLLECTION, query_vector=query_vector, limit=limit, threshold=IMAGE_SCORE_THRESHOLD)
 
     image_map = {}
     for result in results:
@@ -91,4 +128,25 @@ def search_images(query: str, limit: int = 20) -> List[ImageSearchResult]:
     matches = list(image_map.values())
     matches.sort(key=lambda x: x["score"], reverse=True)
 
-    return matches
\ No newline at end of file
+    result_cache.set(result_key, matches)
+    return matches
+
+
+def normalize_query(query: str) -> str:
+    # both query encoders use uncased tokenizers, so lowercasing does not change the vector
+    return " ".join(query.split()).lower()
+
+
+async def get_query_vector(model_name: str, query: str, embed: Callable[[str], Awaitable[List[float]]]) -> List[float]:
+    # the query waits on the event loop for its micro batch, which runs on the batcher thread, and Qdrant is awaited
+    # on the loop too, so a search takes no lane thread
+    key = (model_name, query)
+    vector = query_vector_cache.get(key)
+    if vector is None:
+        vector = await embed(query)
+        query_vector_cache.set(key, vector)
+    return vector
+
+
+def get_search_cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {"query_vectors": query_vector_cache.stats(), "results": result_cache.stats()}
\ No newline at end of file
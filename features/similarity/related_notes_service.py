@@ -0,0 +1,267 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, List, Set
+from commons.qdrant import qdrant_async_client
+from commons.qdrant.qdrant_client import count_points, delete_collection, delete_points, retrieve_points, scroll_points, try_create_collection, upsert_points
+from commons.executors.lane_executor import run_search
+from commons.qdrant.qdrant_helper import NOTE_COLLECTION, RELATED_NOTES_COLLECTION, RELATED_NOTES_REBUILD_LOCK
+from features.similarity.similarity_service import SimilarNoteResult, find_similar_notes
+
+
+RELATED_NOTES_ENABLED = os.getenv("RELATED_NOTES_ENABLED", "true").lower() == "true"
+RELATED_NOTES_LIMIT = int(os.getenv("RELATED_NOTES_LIMIT", "10"))
+RELATED_NOTES_THRESHOLD = float(os.getenv("RELATED_NOTES_THRESHOLD", "0.65"))
+RELATED_NOTES_DEBOUNCE_SECONDS = float(os.getenv("RELATED_NOTES_DEBOUNCE_SECONDS", "2"))
+# age at which a rebuild lock is taken to be left over from a process that died before its rebuild wrote anything
+RELATED_NOTES_REBUILD_LOCK_SECONDS = float(os.getenv("RELATED_NOTES_REBUILD_LOCK_SECONDS", "600"))
+
+
+# note_id -> whether notes related to it must be refreshed as well (the note's chunks changed),
+# notes in here or in progress are served on demand until their entry is rewritten
+dirty_notes: Dict[int, bool] = {}
+in_progress: Set[int] = set()
+# notes recomputed after the latest write, a cascade does not need to queue them again
+fresh_notes: Set[int] = set()
+write_count = 0
+dirty_condition = threading.Condition()
+worker: threading.Thread | None = None
+# set in the process that queued the startup rebuild, the lock is released once its queue is drained
+rebuild_lock_held = False
+stats: Dict[str, Any] = {"updated": 0, "removed": 0, "failed": 0, "served_from_graph": 0, "served_on_demand": 0, "rebuilds": 0, "last_error": None}
+
+
+async def find_related_notes(note_id: int, limit: int = 10, threshold: float = 0.65) -> List[SimilarNoteResult]:
+    # the graph holds the top RELATED_NOTES_LIMIT notes at RELATED_NOTES_THRESHOLD, other parameters are computed on demand
+    # (clustering runs on a search lane thread)
+    if not RELATED_NOTES_ENABLED or limit > RELATED_NOTES_LIMIT or threshold != RELATED_NOTES_THRESHOLD or is_dirty(note_id):
+        count_stat("served_on_demand")
+        return await run_search(find_similar_notes, note_id, limit=limit, threshold=threshold)
+
+    started_at_write = write_count
+    entries, content_hash = await asyncio.gather(qdrant_async_client.retrieve_points(RELATED_NOTES_COLLECTION, [note_id]), read_content_hash(note_id))
+    # an entry computed from other content of the note is a miss, another process may have stored it while this one
+    # (or the other) re-embedded the note
+    if entries and entries[0]["payload"].get("content_hash") == content_hash:
+        count_stat("served_from_graph")
+        return entries[0]["payload"]["related"][:limit]
+
+    count_stat("served_on_demand")
+    related = await run_search(find_similar_notes, note_id, limit=RELATED_NOTES_LIMIT, threshold=RELATED_NOTES_THRESHOLD)
+    # empty results are stored too so the note is not computed again on every request. A write while computing may
+    # have made the result stale, the worker stores the note's entry then
+    if not is_dirty(note_id, started_at_write):
+        await qdrant_async_client.upsert_points(RELATED_NOTES_COLLECTION, [build_related_notes_point(note_id, related, content_hash)])
+    return related[:limit]
+
+
+async def read_content_hash(note_id: int) -> str | None:
+    # all chunks of a note carry its content_hash, None when the note has no chunks
+    chunk = await anext(qdrant_async_client.scroll_points(NOTE_COLLECTION, {"note_id": note_id}, limit=1, with_payload=["content_hash"]), None)
+    return chunk["payload"].get("content_hash") if chunk else None
+
+
+def is_dirty(note_id: int, since_write: int | None = None) -> bool:
+    # with since_write, any write after that write count counts as well
+    with dirty_condition:
+        return note_id in dirty_notes or note_id in in_progress or (since_write is not None and write_count != since_write)
+
+
+def mark_notes_changed(note_ids: List[int]) -> None:
+    # called after a note's chunks or payload were written or deleted
+    global write_count
+    if not RELATED_NOTES_ENABLED or not note_ids:
+        return
+
+    with dirty_condition:
+        write_count += 1
+        fresh_notes.clear()
+        for note_id in note_ids:
+            dirty_notes[note_id] = True
+        dirty_condition.notify()
+    ensure_worker_started()
+
+
+def rebuild_related_notes() -> int:
+    # queues every indexed note, plus graph entries of notes that no longer exist so they get removed
+    note_ids = {point["payload"]["note_id"] for point in scroll_points(NOTE_COLLECTION, {}, with_payload=["note_id"])}
+    note_ids |= {int(point["id"]) for point in scroll_points(RELATED_NOTES_COLLECTION, {}, with_payload=False)}
+
+    with dirty_condition:
+        for note_id in note_ids:
+            dirty_notes.setdefault(note_id, False)
+        stats["rebuilds"] += 1
+        dirty_condition.notify()
+    ensure_worker_started()
+
+    logging.info(f"Queued {len(note_ids)} notes for related notes rebuild")
+    return len(note_ids)
+
+
+def initialize_related_notes() -> None:
+    # builds the graph in the background on first start, later starts only catch up with new writes.
+    # Every uvicorn worker runs this, the rebuild lock lets one of them queue the rebuild
+    global rebuild_lock_held
+    if not RELATED_NOTES_ENABLED:
+        return
+
+    ensure_worker_started()
+    if count_points(RELATED_NOTES_COLLECTION) > 0 or count_points(NOTE_COLLECTION) == 0 or not acquire_rebuild_lock():
+        return
+
+    try:
+        rebuild_related_notes()
+    except Exception:
+        delete_collection(RELATED_NOTES_REBUILD_LOCK)
+        raise
+    with dirty_condition:
+        rebuild_lock_held = True
+
+
+def acquire_rebuild_lock() -> bool:
+    # the lock is a collection holding the time it was taken, a stale one is deleted and taken again. Two processes
+    # taking over the same stale lock at once may both rebuild
+    if try_create_collection(RELATED_NOTES_REBUILD_LOCK):
+        upsert_points(RELATED_NOTES_REBUILD_LOCK, [build_rebuild_lock_point()])
+        return True
+
+    locks = retrieve_points(RELATED_NOTES_REBUILD_LOCK, [0])
+    if not locks:
+        # taken a moment ago and not stamped yet, or by a process that died in between, the stamp starts its clock
+        upsert_points(RELATED_NOTES_REBUILD_LOCK, [build_rebuild_lock_point()])
+        return False
+    if time.time() - locks[0]["payload"]["locked_at"] < RELATED_NOTES_REBUILD_LOCK_SECONDS:
+        logging.info("Related notes rebuild is queued by another process")
+        return False
+
+    logging.warning(f"Taking over related notes rebuild lock older than {RELATED_NOTES_REBUILD_LOCK_SECONDS}s")
+    delete_collection(RELATED_NOTES_REBUILD_LOCK)
+    if not try_create_collection(RELATED_NOTES_REBUILD_LOCK):
+        return False
+    upsert_points(RELATED_NOTES_REBUILD_LOCK, [build_rebuild_lock_point()])
+    return True
+
+
+def release_rebuild_lock() -> None:
+    global rebuild_lock_held
+    with dirty_condition:
+        if not rebuild_lock_held:
+            return
+        rebuild_lock_held = False
+
+    try:
+        delete_collection(RELATED_NOTES_REBUILD_LOCK)
+    except Exception as e:
+        logging.warning(f"failed to release related notes rebuild lock: {e}")
+
+
+def build_rebuild_lock_point() -> Dict[str, Any]:
+    return {"id": 0, "vector": {}, "payload": {"locked_at": time.time()}}
+
+
+def ensure_worker_started() -> None:
+    global worker
+    if worker is not None:
+        return
+
+    with dirty_condition:
+        if worker is None:
+            worker = threading.Thread(target=process_dirty_notes, name="related-notes", daemon=True)
+            worker.start()
+
+
+def process_dirty_notes() -> None:
+    while True:
+        with dirty_condition:
+            while not dirty_notes:
+                dirty_condition.wait()
+
+        # lets a burst of writes (bulk ingest) settle so each note is recomputed once
+        time.sleep(RELATED_NOTES_DEBOUNCE_SECONDS)
+
+        while True:
+            with dirty_condition:
+                if not dirty_notes:
+                    break
+                note_id = next(iter(dirty_notes))
+                cascade = dirty_notes.pop(note_id)
+                in_progress.add(note_id)
+                started_at_write = write_count
+
+            try:
+                update_related_notes(note_id, cascade)
+            except Exception as e:
+                logging.error(f"failed to update related notes for note {note_id}: {e}")
+                count_stat("failed")
+                stats["last_error"] = str(e)
+                started_at_write = -1
+            finally:
+                with dirty_condition:
+                    in_progress.discard(note_id)
+                    if started_at_write == write_count:
+                        fresh_notes.add(note_id)
+
+        release_rebuild_lock()
+
+
+def update_related_notes(note_id: int, cascade: bool) -> None:
+    # notes that listed this note, or are now related to it, hold scores against its old chunks
+    neighbours = referencing_notes(note_id) if cascade else set()
+
+    chunk = next(scroll_points(NOTE_COLLECTION, {"note_id": note_id}, limit=1, with_payload=["content_hash"]), None)
+    if chunk is None:
+        delete_points(RELATED_NOTES_COLLECTION, [note_id])
+        count_stat("removed")
+    else:
+        # the content hash is read before the chunks, an entry stamped with it is never newer than the note
+        related = find_similar_notes(note_id, limit=RELATED_NOTES_LIMIT, threshold=RELATED_NOTES_THRESHOLD)
+        store_related_notes(note_id, related, chunk["payload"].get("content_hash"))
+        neighbours |= {result["note_id"] for result in related}
+        count_stat("updated")
+
+    neighbours.discard(note_id)
+    if neighbours:
+        with dirty_condition:
+            for neighbour_id in neighbours - fresh_notes:
+                dirty_notes.setdefault(neighbour_id, False)
+
+
+def referencing_notes(note_id: int) -> Set[int]:
+    return {int(point["id"]) for point in scroll_points(RELATED_NOTES_COLLECTION, {"related_note_ids": note_id}, with_payload=False)}
+
+
+def store_related_notes(note_id: int, related: List[SimilarNoteResult], content_hash: str | None) -> None:
+    upsert_points(RELATED_NOTES_COLLECTION, [build_related_notes_point(note_id, related, content_hash)])
+
+
+def build_related_notes_point(note_id: int, related: List[SimilarNoteResult], content_hash: str | None) -> Dict[str, Any]:
+    # content_hash is the note's when the entry was computed, entries of other content are not served
+    return {
+        "id": note_id,
+        "vector": {},
+        "payload": {
+            "note_id": note_id,
+            "content_hash": content_hash,
+            "related": related,
+            "related_note_ids": [result["note_id"] for result in related],
+            "updated_at": time.time(),
+        },
+    }
+
+
+def count_stat(name: str) -> None:
+    with dirty_condition:
+        stats[name] += 1
+
+
+def get_related_notes_status() -> Dict[str, Any]:
+    with dirty_condition:
+        return {
+            "enabled": RELATED_NOTES_ENABLED,
+            "limit": RELATED_NOTES_LIMIT,
+            "threshold": RELATED_NOTES_THRESHOLD,
+            "pending": len(dirty_notes) + len(in_progress),
+            **stats,
+        }
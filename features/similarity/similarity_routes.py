@@ -1,6 +1,8 @@
 import logging
 from fastapi import APIRouter, HTTPException, Query
-from features.similarity.similarity_service import find_similar_notes, find_similar_images
+from features.similarity.similarity_service import find_similar_images, get_outlier_cache_stats
+from features.similarity.related_notes_service import find_related_notes, get_related_notes_status, rebuild_related_notes
+from commons.executors.lane_executor import LaneBusyError, run_ingest
 
 
 router = APIRouter()
@@ -9,8 +11,10 @@ router = APIRouter()
 @router.get("/similarity/notes/{note_id}")
 async def find_similar_notes_route(note_id: int, limit: int = 10, threshold: float = 0.65):
     try:
-        results = find_similar_notes(note_id=note_id, limit=limit, threshold=threshold)
+        results = await find_related_notes(note_id=note_id, limit=limit, threshold=threshold)
         return {"results": results}
+    except LaneBusyError:
+        raise
     except Exception as e:
         logging.error(f"failed to find similar notes for note {note_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -19,8 +23,27 @@ async def find_similar_notes_route(note_id: int, limit: int = 10, threshold: flo
 @router.get("/similarity/images/{filename}")
 async def find_similar_images_route(filename: str, limit: int = 10, threshold: float = 0.5):
     try:
-        results = find_similar_images(filename=filename, limit=limit, threshold=threshold)
+        results = await find_similar_images(filename=filename, limit=limit, threshold=threshold)
         return {"results": results}
+    except LaneBusyError:
+        raise
     except Exception as e:
         logging.error(f"failed to find similar images for {filename}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/similarity/stats")
+async def similarity_stats_route():
+    return {"outlier_cache": get_outlier_cache_stats(), "related_notes": get_related_notes_status()}
+
+
+@router.post("/similarity/notes/rebuild")
+async def rebuild_related_notes_route():
+    try:
+        queued = await run_ingest(rebuild_related_notes)
+        return {"queued": queued}
+    except LaneBusyError:
+        raise
+    except Exception as e:
+        logging.error(f"failed to queue related notes rebuild: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
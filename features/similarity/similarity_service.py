@@ -1,12 +1,26 @@
+import os
+import hashlib
 import logging
 import numpy as np
 from typing import List, TypedDict, Dict, Any
 from sklearn.cluster import DBSCAN
-from commons.qdrant.qdrant_client import scroll_points, search_similar
+from commons.cache.ttl_cache import TTLCache
+from commons.qdrant import qdrant_async_client
+from commons.qdrant.qdrant_client import scroll_points, search_similar_batch
 from commons.qdrant.qdrant_helper import NOTE_COLLECTION, IMAGE_COLLECTION
 
 
 OUTLIER_SCORE_THRESHOLD = 0.5
+OUTLIER_CACHE_SIZE = int(os.getenv("OUTLIER_CACHE_SIZE", "1024"))
+OUTLIER_CACHE_TTL_SECONDS = float(os.getenv("OUTLIER_CACHE_TTL_SECONDS", "3600"))
+# chunks of a note used as queries and clustered, bounds the n×n distance matrix and the searches of very large notes.
+# Scroll order follows chunk ids, which are hashes, so a capped note is sampled across its whole length
+MAX_SIMILARITY_CHUNKS = int(os.getenv("MAX_SIMILARITY_CHUNKS", "1000"))
+
+
+# note_id -> (chunk fingerprint, outliers), chunk ids change with the chunk text so a note
+# re-embedded by another process is detected even without invalidate_outlier_cache
+outlier_cache = TTLCache(OUTLIER_CACHE_SIZE, OUTLIER_CACHE_TTL_SECONDS)
 
 
 class NoteScore(TypedDict):
@@ -36,55 +50,48 @@ class OutlierChunk(TypedDict):
 
 
 def find_similar_notes(note_id: int, limit: int = 10, threshold: float = 0.5) -> List[SimilarNoteResult]:
-    source_chunks = scroll_points(NOTE_COLLECTION, {"note_id": note_id}, limit=1000, with_vectors=True)
+    source_chunks = list(scroll_points(NOTE_COLLECTION, {"note_id": note_id}, limit=MAX_SIMILARITY_CHUNKS, with_vectors=True))
 
     if not source_chunks:
         return []
 
     logging.debug(f"Finding similar notes for note {note_id} with {len(source_chunks)} chunks")
 
-    outlier_chunks = find_outlier_chunks(source_chunks)
+    outlier_chunks = get_outlier_chunks(note_id, source_chunks)
     outlier_chunk_ids = {c['chunk_id'] for c in outlier_chunks if c['outlier_score'] >= OUTLIER_SCORE_THRESHOLD}
 
     logging.debug(f"Found {len(outlier_chunk_ids)} outlier chunks (score >= {OUTLIER_SCORE_THRESHOLD})")
 
     note_scores: Dict[int, NoteScore] = {}
 
+    query_chunks = []
     for i, chunk in enumerate(source_chunks):
-        vector = chunk["vector"]
-
-        if not vector:
+        if not chunk["vector"]:
             logging.warning(f"Chunk {i} has no vector")
             continue
+        query_chunks.append((i, chunk))
+
+    # batched requests for all chunks, the source note is excluded by Qdrant instead of filtered here
+    batch_results = search_similar_batch(
+        collection_name=NOTE_COLLECTION,
+        query_vectors=[chunk["vector"] for _, chunk in query_chunks],
+        limit=limit * 3,
+        threshold=threshold,
+        exclude={"note_id": note_id}
+    )
 
+    for (i, chunk), similar_chunks in zip(query_chunks, batch_results):
         is_outlier = chunk["id"] in outlier_chunk_ids
         chunk_type = "outlier" if is_outlier else "routine"
 
-        logging.debug(f"Searching with {chunk_type} chunk {i}: {chunk['payload'].get('text', '')[:80]}...")
-
-        similar_chunks = search_similar(
-            collection_name=NOTE_COLLECTION,
-            query_vector=vector,
-            limit=limit * 3,
-            threshold=threshold
-        )
-
         if similar_chunks:
-            top_match = next((match for match in similar_chunks if match['payload'].get('note_id') != note_id), None)
-
-            if top_match:
-                logging.debug(f"{chunk_type.capitalize()} chunk {i} found {len(similar_chunks)} matches. Top: note_id={top_match['payload'].get('note_id')}, score={top_match['score']:.4f}")
-            else:
-                logging.debug(f"{chunk_type.capitalize()} chunk {i} found {len(similar_chunks)} matches (all from same note)")
+            top_match = similar_chunks[0]
+            logging.debug(f"{chunk_type.capitalize()} chunk {i} found {len(similar_chunks)} matches. Top: note_id={top_match['payload'].get('note_id')}, score={top_match['score']:.4f}")
         else:
             logging.debug(f"{chunk_type.capitalize()} chunk {i} found 0 matches")
 
         for result in similar_chunks:
             result_note_id = result["payload"].get("note_id")
-
-            if result_note_id == note_id:
-                continue
-
             score = result["score"]
 
             if result_note_id not in note_scores:
@@ -130,6 +137,29 @@ def find_similar_notes(note_id: int, limit: int = 10, threshold: float = 0.5) ->
     return results
 
 
+def get_outlier_chunks(note_id: int, chunks: List[Dict[str, Any]]) -> List[OutlierChunk]:
+    fingerprint = chunk_fingerprint(chunks)
+    cached = outlier_cache.get(note_id)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+
+    outlier_chunks = find_outlier_chunks(chunks)
+    outlier_cache.set(note_id, (fingerprint, outlier_chunks))
+    return outlier_chunks
+
+
+def chunk_fingerprint(chunks: List[Dict[str, Any]]) -> str:
+    return hashlib.sha256("\n".join(sorted(chunk["id"] for chunk in chunks)).encode("utf-8")).hexdigest()
+
+
+def invalidate_outlier_cache(note_id: int) -> None:
+    outlier_cache.delete(note_id)
+
+
+def get_outlier_cache_stats() -> Dict[str, Any]:
+    return outlier_cache.stats()
+
+
 def find_outlier_chunks(chunks: List[Dict[str, Any]], eps: float = 0.3, min_samples: int = 3) -> List[OutlierChunk]:
     if not chunks:
         logging.warning(f"No chunks provided")
@@ -153,10 +183,15 @@ def find_outlier_chunks(chunks: List[Dict[str, Any]], eps: float = 0.3, min_samp
         logging.warning(f"Not enough valid vectors for clustering: {len(vectors)}")
         return []
 
-    X = np.array(vectors)
+    # cosine distances of all pairs as one matrix product on normalized vectors, shared by DBSCAN and the scores
+    X = np.array(vectors, dtype=np.float64)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    X /= np.where(norms == 0, 1, norms)
+    distances = np.clip(1 - X @ X.T, 0, 2)
+    np.fill_diagonal(distances, 0)
 
-    clustering = DBSCAN(eps=eps, min_samples=min_samples, metric='cosine')
-    labels = clustering.fit_predict(X)
+    clustering = DBSCAN(eps=eps, min_samples=min_samples, metric='precomputed')
+    labels = clustering.fit_predict(distances)
 
     outlier_indices = [i for i, label in enumerate(labels) if label == -1]
 
@@ -165,23 +200,18 @@ def find_outlier_chunks(chunks: List[Dict[str, Any]], eps: float = 0.3, min_samp
 
     logging.debug(f"Found {n_clusters} clusters and {n_outliers} outliers")
 
+    # mean distance to every other chunk, the diagonal is zero
+    avg_distances = distances.sum(axis=1) / (len(vectors) - 1)
+
     results = []
     for idx in outlier_indices:
         chunk = chunk_data[idx]
 
-        distances = []
-        for other_idx, other_vector in enumerate(vectors):
-            if idx != other_idx:
-                cos_sim = np.dot(X[idx], other_vector) / (np.linalg.norm(X[idx]) * np.linalg.norm(other_vector))
-                distances.append(1 - cos_sim)
-
-        avg_distance = np.mean(distances) if distances else 0
-
         results.append({
             "chunk_id": chunk["id"],
             "text": chunk["payload"].get("text", ""),
             "chunk_index": chunk["payload"].get("chunk_index", 0),
-            "outlier_score": float(avg_distance),
+            "outlier_score": float(avg_distances[idx]),
             "cluster_label": -1
         })
 
@@ -200,14 +230,13 @@ class SimilarImageResult(TypedDict):
     format: str | None
 
 
-def find_similar_images(filename: str, limit: int = 10, threshold: float = 0.5) -> List[SimilarImageResult]:
-    source_images = scroll_points(IMAGE_COLLECTION, {"filename": filename}, limit=1, with_vectors=True)
+async def find_similar_images(filename: str, limit: int = 10, threshold: float = 0.5) -> List[SimilarImageResult]:
+    source_image = await anext(qdrant_async_client.scroll_points(IMAGE_COLLECTION, {"filename": filename}, limit=1, with_vectors=True), None)
 
-    if not source_images:
+    if source_image is None:
         logging.warning(f"Image not found: {filename}")
         return []
 
-    source_image = source_images[0]
     vector = source_image["vector"]
 
     if not vector:
@@ -216,7 +245,7 @@ def find_similar_images(filename: str, limit: int = 10, threshold: float = 0.5)
 
     logging.debug(f"Finding similar images for {filename}")
 
-    similar_images = search_similar(
+    similar_images = await qdrant_async_client.search_similar(
         collection_name=IMAGE_COLLECTION,
         query_vector=vector,
         limit=limit + 1,
@@ -1,7 +1,11 @@
 import os
+import time
 import logging
+import threading
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
 
 logging.basicConfig(level=logging.INFO, format='%(levelname)s:%(name)s:%(message)s')
 logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -9,21 +13,82 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 from features.embedding.embedding_routes import router as embedding_router
 from features.search.search_routes import router as search_router
 from features.similarity.similarity_routes import router as similarity_router
-from commons.qdrant.qdrant_client import health_check
+from features.metrics.metrics_routes import router as metrics_router
+from commons.metrics.metrics_middleware import MetricsMiddleware
+from features.profiling.profiling_routes import router as profiling_router
+from commons.profiling.profiling_middleware import ProfilingMiddleware
+from commons.qdrant.qdrant_async_client import health_check
+from commons.executors.lane_executor import LaneBusyError
+from commons.qdrant.qdrant_helper import ensure_collections, warmup_models
+from features.chunking.segmentation_service import warmup_segmentation
+from features.similarity.related_notes_service import initialize_related_notes
 
-app = FastAPI(title="Zen Intelligence", version="0.1.0")
+WARMUP_RETRY_SECONDS = 5
+
+readiness = {"models": False, "collections": False}
+
+
+def warm_up() -> None:
+    # runs in the background so the process starts (and answers /live) before models are loaded or Qdrant
+    # and the embedding workers are up
+    start = time.time()
+    while not all(readiness.values()):
+        try:
+            if not readiness["models"]:
+                warmup_segmentation()
+                warmup_models()
+                readiness["models"] = True
+                logging.info(f"models warmed up ({time.time() - start:.2f}s)")
+            if not readiness["collections"]:
+                ensure_collections()
+                initialize_related_notes()
+                readiness["collections"] = True
+        except Exception as e:
+            logging.warning(f"warmup not finished, retrying in {WARMUP_RETRY_SECONDS}s: {e}")
+            time.sleep(WARMUP_RETRY_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+    yield
+
+
+app = FastAPI(title="Zen Intelligence", version="0.1.0", lifespan=lifespan)
 
 app.include_router(embedding_router)
 app.include_router(search_router)
 app.include_router(similarity_router)
+app.include_router(metrics_router)
+app.include_router(profiling_router)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+@app.exception_handler(LaneBusyError)
+async def lane_busy_handler(request: Request, exc: LaneBusyError):
+    logging.warning(f"rejected {request.method} {request.url.path}: {exc}")
+    return JSONResponse(status_code=exc.status_code, content={"detail": str(exc)}, headers={"Retry-After": "1"})
 
 @app.get("/health")
 async def health():
-    qdrant_healthy = health_check()
+    qdrant_healthy = await health_check()
     if not qdrant_healthy:
         raise HTTPException(status_code=503, detail="Service unavailable")
     return {"status": "ok"}
 
+@app.get("/live")
+async def live():
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    if not all(readiness.values()):
+        raise HTTPException(status_code=503, detail={"status": "warming up", **readiness})
+    qdrant_healthy = await health_check()
+    if not qdrant_healthy:
+        raise HTTPException(status_code=503, detail="Qdrant unavailable")
+    return {"status": "ready"}
+
 @app.get("/")
 async def root():
     return {"message": "Zen Intelligence API"}